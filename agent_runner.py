@@ -0,0 +1,131 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, CancelledError
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+_current_run = contextvars.ContextVar("current_run", default=None)
+
+
+def current_run():
+    """Returns the AgentRun executing on this thread, if any."""
+    return _current_run.get()
+
+
+class RunCancelled(Exception):
+    """Raised inside a worker when its run has been cancelled."""
+
+
+class _CancelledCallbackFilter(logging.Filter):
+    """Drops LangChain's "Error in ... callback" warning for RunCancelled.
+
+    Callback errors are logged at WARNING before they are re-raised, but a
+    cancellation is the expected way for a run to stop.
+    """
+
+    def filter(self, record):
+        return not (isinstance(record.args, tuple) and repr(RunCancelled()) in record.args)
+
+
+logging.getLogger("langchain_core.callbacks.manager").addFilter(_CancelledCallbackFilter())
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """Aborts an agent run at the next LLM token, LLM call or tool call
+    once its cancel event is set."""
+
+    raise_error = True
+
+    def __init__(self, cancel_event):
+        self.cancel_event = cancel_event
+
+    def _check(self):
+        if self.cancel_event.is_set():
+            raise RunCancelled()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check()
+
+    def on_llm_new_token(self, token, **kwargs):
+        self._check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check()
+
+
+class AgentRun:
+    """Handle for one agent turn submitted to an AgentRunner.
+
+    Also acts as the container for a `streaming.StreamHandler`: the worker
+    writes the streamed text here and the UI thread polls `text`, since
+    Streamlit elements cannot be updated from worker threads.
+    """
+
+    def __init__(self, query):
+        self.query = query
+        self.charts = []
+        self.future = None
+        self.cancel_event = threading.Event()
+        self._text = ""
+        self._lock = threading.Lock()
+
+    def markdown(self, text):
+        with self._lock:
+            self._text = text
+
+    def empty(self):
+        self.markdown("")
+
+    @property
+    def text(self):
+        with self._lock:
+            return self._text
+
+    def cancel(self):
+        self.cancel_event.set()
+        if self.future is not None:
+            self.future.cancel()
+
+    def done(self):
+        return self.future is not None and self.future.done()
+
+    def result(self):
+        """Returns the agent output, raising RunCancelled if it was cancelled."""
+        try:
+            return self.future.result()
+        except CancelledError:
+            raise RunCancelled()
+
+
+class AgentRunner:
+    """Bounded worker pool shared by all sessions for running agent turns."""
+
+    def __init__(self, max_workers=4):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="agent-run")
+
+    def start(self, run, agent, inputs, callbacks=None):
+        """Submits `agent.invoke(inputs)` for `run` and returns immediately.
+
+        Args:
+            run (AgentRun): handle to attach the submitted turn to
+            agent: runnable to invoke, e.g. an AgentExecutor
+            inputs (dict): agent inputs
+            callbacks (list): extra callback handlers for the run
+        """
+        callbacks = [CancellationHandler(run.cancel_event), *(callbacks or [])]
+
+        def target():
+            token = _current_run.set(run)
+            try:
+                if run.cancel_event.is_set():
+                    raise RunCancelled()
+                return agent.invoke(inputs, {"callbacks": callbacks})
+            finally:
+                _current_run.reset(token)
+
+        run.future = self._executor.submit(target)
+        return run
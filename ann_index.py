@@ -0,0 +1,158 @@
+import time
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+
+def top_k(scores, k):
+    """Indices of the `k` highest scores, best first."""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+def kmeans(vectors, n_clusters, n_iter=20, sample_size=100_000, seed=0):
+    """Spherical k-means over L2-normalized rows, returns the centroids.
+
+    Args:
+        vectors (np.ndarray): normalized vectors, one per row
+        n_clusters (int): number of centroids
+        n_iter (int): Lloyd iterations
+        sample_size (int): number of rows the centroids are trained on
+        seed (int): random seed
+    """
+    rng = np.random.default_rng(seed)
+    if len(vectors) > sample_size:
+        vectors = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = np.array(vectors[rng.choice(len(vectors), n_clusters, replace=False)], dtype=np.float32)
+    for _ in range(n_iter):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        empty = norms[:, 0] == 0
+        # re-seed empty clusters with random rows
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        norms[empty] = 1
+        centroids = sums / norms
+    return centroids
+
+
+class IVFIndex:
+    """Inverted-file index over the rows of a NumpyVectorStore matrix.
+
+    Rows are grouped by their nearest k-means centroid. A query is scored
+    exactly against the rows of its `n_probe` nearest lists only; more probes
+    give higher recall at the cost of latency.
+    """
+
+    FILES = ("ivf_centroids.npy", "ivf_order.npy", "ivf_offsets.npy")
+
+    def __init__(self, centroids, order, offsets, n_probe=8):
+        self.centroids = centroids
+        self.order = order
+        self.offsets = offsets
+        self.n_probe = n_probe
+
+    @property
+    def size(self):
+        """Number of matrix rows covered by the index."""
+        return len(self.order)
+
+    @classmethod
+    def build(cls, matrix, n_clusters=None, n_probe=8, **kwargs):
+        """Trains the centroids on `matrix` and assigns every row to a list.
+
+        `n_clusters` defaults to about 4 * sqrt(number of rows).
+        """
+        n_clusters = n_clusters or max(1, int(4 * np.sqrt(len(matrix))))
+        centroids = kmeans(matrix, n_clusters, **kwargs)
+        assignment = np.empty(len(matrix), dtype=np.int64)
+        for start in range(0, len(matrix), 65_536):
+            block = matrix[start:start + 65_536]
+            assignment[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        offsets = np.searchsorted(assignment[order], np.arange(len(centroids) + 1))
+        return cls(centroids, order, offsets, n_probe)
+
+    def candidates(self, query, n_probe=None):
+        """Matrix rows stored in the lists nearest to a normalized query."""
+        probes = top_k(self.centroids @ query, n_probe or self.n_probe)
+        return np.concatenate([self.order[self.offsets[p]:self.offsets[p + 1]] for p in probes])
+
+    def save(self, folder):
+        for name, array in zip(self.FILES, (self.centroids, self.order, self.offsets)):
+            np.save(Path(folder) / name, array)
+
+    @classmethod
+    def load(cls, folder, n_probe=8, mmap=True):
+        """Loads an index saved with `save`, or returns None if there is none."""
+        paths = [Path(folder) / name for name in cls.FILES]
+        if not all(path.exists() for path in paths):
+            return None
+        arrays = [np.load(path, mmap_mode="r" if mmap else None) for path in paths]
+        return cls(*arrays, n_probe=n_probe)
+
+
+def recall_report(store, n_queries=200, k=10, n_probes=(1, 2, 4, 8, 16, 32), seed=0):
+    """Measures recall@k and latency of the store's index against exact search.
+
+    Queries are stored vectors with added noise, so they resemble real
+    queries without needing the embedding model.
+    """
+    rng = np.random.default_rng(seed)
+    matrix = store.matrix
+    queries = matrix[rng.choice(len(matrix), min(n_queries, len(matrix)), replace=False)]
+    queries = queries + rng.normal(scale=0.05, size=queries.shape).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    start = time.perf_counter()
+    exact = [set(top_k(matrix @ q, k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    rows = [("exact", 1.0, exact_ms)]
+    for n_probe in n_probes:
+        start = time.perf_counter()
+        found = [store.search_indices(q, k, n_probe=n_probe) for q in queries]
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(exact[i] & set(f.tolist())) / len(exact[i]) for i, f in enumerate(found)])
+        rows.append((f"n_probe={n_probe}", recall, latency_ms))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build and evaluate IVF indexes for saved NumpyVectorStores.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build = subparsers.add_parser(
+        "build", help="train an IVF index and save it next to the store, e.g. a folder in INGESTION.STORE_DIR"
+    )
+    build.add_argument("folder", help="folder written by NumpyVectorStore.save")
+    build.add_argument("--clusters", type=int, default=None, help="number of lists, default 4*sqrt(n)")
+    build.add_argument("--iterations", type=int, default=20)
+    report = subparsers.add_parser("report", help="print recall@k and latency against exact search")
+    report.add_argument("folder", help="folder written by NumpyVectorStore.save")
+    report.add_argument("--k", type=int, default=10)
+    report.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    from numpy_store import NumpyVectorStore
+    store = NumpyVectorStore.load(args.folder, embedding=None)
+    if args.command == "build":
+        start = time.perf_counter()
+        index = IVFIndex.build(store.matrix, n_clusters=args.clusters, n_iter=args.iterations)
+        index.save(args.folder)
+        print(f"Built {len(index.centroids)} lists over {index.size} vectors in {time.perf_counter() - start:.1f}s")
+    else:
+        if store.index is None:
+            parser.error(f"no IVF index in {args.folder}, run the build command first")
+        print(f"{'mode':<14}{'recall@' + str(args.k):>10}{'ms/query':>10}")
+        for mode, recall, latency_ms in recall_report(store, n_queries=args.queries, k=args.k):
+            print(f"{mode:<14}{recall:>10.3f}{latency_ms:>10.3f}")
+
+
+if __name__ == "__main__":
+    main()
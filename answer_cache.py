@@ -0,0 +1,128 @@
+import re
+import time
+import threading
+from functools import lru_cache
+from collections import OrderedDict
+
+import numpy as np
+
+# Words that change what a question asks for while barely moving its embedding
+QUALIFIERS = frozenset({
+    "most", "least", "fewest", "more", "less", "fewer", "top", "bottom", "first", "last",
+    "highest", "lowest", "largest", "smallest", "biggest", "best", "worst", "max", "min",
+    "maximum", "minimum", "average", "avg", "total", "sum", "count", "before", "after",
+    "above", "below", "over", "under", "ascending", "descending", "not", "no", "without",
+})
+
+
+def normalize_question(text):
+    """Lowercases a question and strips punctuation and repeated whitespace."""
+    text = re.sub(r"[^\w\s]", " ", text.lower())
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def question_signature(normalized):
+    """Numbers and qualifier words of a normalized question, in order."""
+    return tuple(word for word in normalized.split() if word.isdigit() or word in QUALIFIERS)
+
+
+class AnswerCache:
+    """Process-wide cache of agent answers, shared by all sessions.
+
+    A question hits the cache if its normalized text matches a stored question
+    exactly, or if its embedding is at least `similarity_threshold` cosine
+    similar to one that has the same numbers and qualifier words ("top 5" never
+    matches "top 10", nor "most" "fewest"). Only questions that stand on their
+    own should be cached, since the key does not include the conversation.
+    Entries are scoped to a database version, expire after
+    `ttl` seconds and are evicted least-recently-used beyond `max_entries`.
+    """
+
+    def __init__(self, embedding_model, max_entries=256, ttl=3600, similarity_threshold=0.95):
+        self.embedding_model = embedding_model
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.similarity_threshold = similarity_threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # a miss is normally followed by a put for the same question
+        self._embed = lru_cache(maxsize=64)(self._embed_uncached)
+
+    def _embed_uncached(self, normalized):
+        vector = np.asarray(self.embedding_model.embed_query(normalized), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _purge_expired(self, now):
+        expired = [k for k, entry in self._entries.items() if entry["expires_at"] <= now]
+        for key in expired:
+            del self._entries[key]
+
+    def get(self, question, version):
+        """Returns the cached value for a question, or None on a miss.
+
+        Args:
+            question (str): question as typed by the user
+            version (str): version of the data the answer was computed from
+        """
+        normalized = normalize_question(question)
+        with self._lock:
+            self._purge_expired(time.monotonic())
+            entry = self._entries.get((version, normalized))
+            if entry is not None:
+                self._entries.move_to_end((version, normalized))
+                self.hits += 1
+                return entry["value"]
+            signature = question_signature(normalized)
+            candidates = [
+                (k, e) for k, e in self._entries.items() if k[0] == version and e["signature"] == signature
+            ]
+
+        if not candidates:
+            with self._lock:
+                self.misses += 1
+            return None
+
+        vector = self._embed(normalized)
+        matrix = np.stack([e["vector"] for _, e in candidates])
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+
+        with self._lock:
+            if scores[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            key, entry = candidates[best]
+            if key not in self._entries:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry["value"]
+
+    def put(self, question, version, value):
+        """Stores the value computed for a question.
+
+        Args:
+            question (str): question as typed by the user
+            version (str): version of the data the answer was computed from
+            value: answer to return for this and similar questions
+        """
+        normalized = normalize_question(question)
+        entry = {
+            "value": value,
+            "vector": self._embed(normalized),
+            "signature": question_signature(normalized),
+            "expires_at": time.monotonic() + self.ttl,
+        }
+        with self._lock:
+            self._entries[(version, normalized)] = entry
+            self._entries.move_to_end((version, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,5 +1,6 @@
 import utils
 import streamlit as st
+from resource_cache import SESSION
 from streaming import StreamHandler
 
 from langchain.chains import ConversationChain
@@ -16,7 +17,7 @@ class ContextChatbot:
         utils.sync_st_session()
         self.llm = utils.configure_llm()
     
-    @st.cache_resource
+    @utils.cache_resource("context_chat.chain", scope=SESSION)
     def setup_chain(_self):
         memory = ConversationBufferMemory()
         chain = ConversationChain(llm=_self.llm, memory=memory, verbose=False)
@@ -1,7 +1,8 @@
 import utils
 import streamlit as st
+from prompts import REACT_CHAT_PROMPT
+from search_cache import SearchCache
 
-from langchain import hub
 from langchain_openai import ChatOpenAI
 from langchain.memory import ConversationBufferMemory
 from langchain_community.tools import DuckDuckGoSearchRun
@@ -20,24 +21,30 @@ class InternetChatbot:
         utils.sync_st_session()
         self.llm = utils.configure_llm()
 
-    # @st.cache_resource(show_spinner='Connecting..')
-    def setup_agent(_self):
-        # Define tool
+    @utils.cache_resource("internet_chat.search_cache", show_spinner='Connecting..')
+    def get_search_cache(_self):
+        # Shared by all sessions, so repeated searches skip DuckDuckGo
         ddg_search = DuckDuckGoSearchRun()
+        config = st.secrets.get("SEARCH_CACHE", {})
+        return SearchCache(
+            ddg_search.run,
+            ttl=config.get("TTL", 900),
+            max_entries=config.get("MAX_ENTRIES", 1024)
+        )
+
+    def setup_agent(self):
+        # Define tool
         tools = [
             Tool(
                 name="DuckDuckGoSearch",
-                func=ddg_search.run,
+                func=self.get_search_cache().run,
                 description="Useful for when you need to answer questions about current events. You should ask targeted questions",
             )
         ]
 
-        # Get the prompt - can modify this
-        prompt = hub.pull("hwchase17/react-chat")
-
         # Setup LLM and Agent
         memory = ConversationBufferMemory(memory_key="chat_history")
-        agent = create_react_agent(_self.llm, tools, prompt)
+        agent = create_react_agent(self.llm, tools, REACT_CHAT_PROMPT)
         agent_executor = AgentExecutor(agent=agent, tools=tools, memory=memory, verbose=False)
         return agent_executor, memory
 
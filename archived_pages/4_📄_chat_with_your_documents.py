@@ -1,12 +1,14 @@
 import os
 import utils
+import hashlib
+import ingestion
 import streamlit as st
+from resource_cache import SESSION
 from streaming import StreamHandler
+from chat_memory import BoundedConversationMemory
+from numpy_store import NumpyVectorStore
 
-from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
-from langchain_community.document_loaders import PyPDFLoader
-from langchain_community.vectorstores import DocArrayInMemorySearch
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 
 
@@ -20,53 +22,88 @@ class CustomDocChatbot:
     def __init__(self):
         utils.sync_st_session()
         self.llm = utils.configure_llm()
-        self.embedding_model = utils.configure_embedding_model()
-
-    def save_file(self, file):
-        folder = 'tmp'
-        if not os.path.exists(folder):
-            os.makedirs(folder)
-        
-        file_path = f'./{folder}/{file.name}'
-        with open(file_path, 'wb') as f:
-            f.write(file.getvalue())
-        return file_path
-
-    @st.spinner('Analyzing documents..')
-    def setup_qa_chain(self, uploaded_files):
-        # Load documents
-        docs = []
-        for file in uploaded_files:
-            file_path = self.save_file(file)
-            loader = PyPDFLoader(file_path)
-            docs.extend(loader.load())
-        
-        # Split documents and store in vector db
+        self.embedding_model = utils.configure_cached_embedding_model()
+
+    @utils.cache_resource("doc_chat.parse_pool")
+    def get_parse_pool(_self):
+        # one pool for the process, workers stay up between uploads
+        config = st.secrets.get("INGESTION", {})
+        return ingestion.PdfParsePool(
+            max_workers=config.get("PARSE_WORKERS"),
+            min_pages=config.get("PARALLEL_MIN_PAGES", 64)
+        )
+
+    # one index per set of uploads, so keep only the recently used ones
+    @utils.cache_resource("doc_chat.vectordb", show_spinner='Analyzing documents..', max_entries=8, ttl=6 * 3600)
+    def setup_vectordb(_self, file_hashes, _uploaded_files):
+        # Index is cached on the content hashes of the uploads, not the file objects
+        config = st.secrets.get("INGESTION", {})
+        stats = ingestion.IngestionStats()
+
+        # Stores saved to STORE_DIR are reused across restarts, together with
+        # any IVF index built for them offline with `ann_index.py build`
+        store_dir = config.get("STORE_DIR")
+        if store_dir:
+            folder = os.path.join(store_dir, hashlib.sha256("".join(file_hashes).encode()).hexdigest()[:32])
+            if os.path.exists(os.path.join(folder, "docs.json")):
+                return NumpyVectorStore.load(folder, _self.embedding_model)
+
+        # Load documents straight from the uploaded bytes, one file at a time,
+        # large files are parsed in parallel
+        files = ((file.name, file.getvalue()) for file in _uploaded_files)
+        pages = ingestion.iter_pdf_pages(
+            files,
+            stats,
+            pool=_self.get_parse_pool(),
+            pages_per_task=config.get("PAGES_PER_TASK", 16)
+        )
+
+        # Split documents and store in vector db as pages arrive
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=1000,
             chunk_overlap=200
         )
-        splits = text_splitter.split_documents(docs)
-        vectordb = DocArrayInMemorySearch.from_documents(splits, self.embedding_model)
-
-        # Define retriever
-        retriever = vectordb.as_retriever(
-            search_type='mmr',
-            search_kwargs={'k':2, 'fetch_k':4}
+        vectordb = NumpyVectorStore(_self.embedding_model)
+        ingestion.ingest_documents(
+            pages, vectordb, text_splitter, stats, batch_size=config.get("BATCH_SIZE", 64)
         )
 
-        # Setup memory for contextual conversation        
-        memory = ConversationBufferMemory(
+        large = len(vectordb) >= config.get("ANN_MIN_CHUNKS", 50_000)
+        if store_dir:
+            vectordb.save(folder)
+            if large:
+                utils.logger.info(f"Saved {len(vectordb)} chunks to {folder}, run `python ann_index.py build {folder}` to index them")
+        elif large:
+            # Switch to approximate search once exact search gets slow
+            vectordb.build_index(n_probe=config.get("ANN_N_PROBE", 8))
+        return vectordb
+
+    # Setup memory for contextual conversation, the chain is rebuilt every
+    # run but the conversation has to carry over
+    @utils.cache_resource("doc_chat.memory", scope=SESSION)
+    def setup_memory(_self):
+        return BoundedConversationMemory(
+            llm=_self.llm,
             memory_key='chat_history',
             output_key='answer',
             return_messages=True
         )
 
+    def setup_qa_chain(self, uploaded_files):
+        file_hashes = tuple(hashlib.sha256(file.getvalue()).hexdigest() for file in uploaded_files)
+        vectordb = self.setup_vectordb(file_hashes, uploaded_files)
+
+        # Define retriever
+        retriever = vectordb.as_retriever(
+            search_type='mmr',
+            search_kwargs={'k':2, 'fetch_k':4}
+        )
+
         # Setup LLM and QA chain
         qa_chain = ConversationalRetrievalChain.from_llm(
             llm=self.llm,
             retriever=retriever,
-            memory=memory,
+            memory=self.setup_memory(),
             return_source_documents=True,
             verbose=False
         )
@@ -23,7 +23,7 @@ class SqlChatbot:
         utils.sync_st_session()
         self.llm = utils.configure_llm()
     
-    @st.cache_resource
+    @utils.cache_resource("sql_chat.db")
     def get_db(_self, db_uri):
         if db_uri == 'USE_SAMPLE_DB':
             db_filepath = (Path(__file__).parent.parent / "assets/Chinook.db").absolute()
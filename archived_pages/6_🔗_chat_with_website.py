@@ -1,17 +1,19 @@
 import os
+import time
 import utils
-import requests
-import traceback
+import ingestion
 import validators
 import streamlit as st
+from resource_cache import SESSION
 from streaming import StreamHandler
+from chat_memory import BoundedConversationMemory
+from numpy_store import NumpyVectorStore
+from web_fetch import PageFetcher
 
-from langchain.memory import ConversationBufferMemory
 from langchain.chains import ConversationalRetrievalChain
 
 from langchain_core.documents.base import Document
 from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import DocArrayInMemorySearch
 
 st.set_page_config(page_title="ChatWebsite", page_icon="🔗")
 st.header('Chat with Website')
@@ -23,42 +25,92 @@ class ChatbotWeb:
     def __init__(self):
         utils.sync_st_session()
         self.llm = utils.configure_llm()
-        self.embedding_model = utils.configure_embedding_model()
+        self.embedding_model = utils.configure_cached_embedding_model()
+
+    @utils.cache_resource("website_chat.page_fetcher")
+    def get_page_fetcher(_self):
+        config = st.secrets.get("WEB_FETCH", {})
+        return PageFetcher(
+            base_url="https://r.jina.ai/",
+            max_workers=config.get("MAX_WORKERS", 8),
+            per_host=config.get("PER_HOST", 4),
+            timeout=(config.get("CONNECT_TIMEOUT", 5), config.get("READ_TIMEOUT", 30)),
+            max_connections=config.get("PROXY_CONNECTIONS"),
+            max_cache_entries=config.get("CACHE_ENTRIES", 1000)
+        )
 
     def scrape_website(self, url):
-        content = ""
-        try:
-            base_url = "https://r.jina.ai/"
-            final_url = base_url + url
-            headers = {
-                'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
-                }
-            response = requests.get(final_url, headers=headers)
-            content = response.text
-        except Exception as e:
-            traceback.print_exc()
-        return content
-
-    @st.cache_resource(show_spinner='Analyzing webpage', ttl=3600)
-    def setup_vectordb(_self, websites):
-        # Scrape and load documents
-        docs = []
-        for url in websites:
-            docs.append(Document(
-                page_content=_self.scrape_website(url),
-                metadata={"source":url}
+        return self.get_page_fetcher().fetch(url)
+
+    def setup_vectordb(self, websites, ttl=3600):
+        """Brings the session's vector db in line with `websites`.
+
+        Only sites that were added, or last scraped more than `ttl` seconds
+        ago, are scraped and embedded; removed sites have their chunks deleted
+        and every other site keeps its vectors.
+        """
+        if "web_vectordb" not in st.session_state:
+            st.session_state["web_vectordb"] = NumpyVectorStore(self.embedding_model)
+            st.session_state["indexed_websites"] = {}
+        vectordb = st.session_state["web_vectordb"]
+        indexed = st.session_state["indexed_websites"]
+
+        now = time.time()
+        removed = [url for url in indexed if url not in websites]
+        stale = [url for url in websites if url in indexed and now - indexed[url] > ttl]
+        added = [url for url in websites if url not in indexed]
+
+        outdated = set(removed + stale)
+        if outdated:
+            vectordb.delete([doc.id for doc in vectordb.docs if doc.metadata["source"] in outdated])
+            for url in outdated:
+                del indexed[url]
+
+        to_scrape = stale + added
+        if to_scrape:
+            with st.spinner('Analyzing webpage'):
+                # Scrape the new websites concurrently and load documents
+                contents = self.get_page_fetcher().fetch_all(to_scrape)
+                docs = []
+                for url, content in zip(to_scrape, contents):
+                    docs.append(Document(
+                        page_content=content,
+                        metadata={"source":url}
+                        )
+                    )
+
+                # Split documents and add them to the vector db
+                text_splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=1000,
+                    chunk_overlap=200
                 )
-            )
+                config = st.secrets.get("INGESTION", {})
+                ingestion.ingest_documents(
+                    docs,
+                    vectordb,
+                    text_splitter,
+                    ingestion.IngestionStats(),
+                    batch_size=config.get("BATCH_SIZE", 64)
+                )
+            for url in to_scrape:
+                indexed[url] = now
 
-        # Split documents and store in vector db
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200
-        )
-        splits = text_splitter.split_documents(docs)
-        vectordb = DocArrayInMemorySearch.from_documents(splits, _self.embedding_model)
+            # Switch to approximate search once exact search gets slow
+            if vectordb.index is None and len(vectordb) >= config.get("ANN_MIN_CHUNKS", 50_000):
+                vectordb.build_index(n_probe=config.get("ANN_N_PROBE", 8))
         return vectordb
 
+    # Setup memory for contextual conversation, the chain is rebuilt every
+    # run but the conversation has to carry over
+    @utils.cache_resource("website_chat.memory", scope=SESSION)
+    def setup_memory(_self):
+        return BoundedConversationMemory(
+            llm=_self.llm,
+            memory_key='chat_history',
+            output_key='answer',
+            return_messages=True
+        )
+
     def setup_qa_chain(self, vectordb):
 
         # Define retriever
@@ -67,18 +119,11 @@ class ChatbotWeb:
             search_kwargs={'k':2, 'fetch_k':4}
         )
 
-        # Setup memory for contextual conversation        
-        memory = ConversationBufferMemory(
-            memory_key='chat_history',
-            output_key='answer',
-            return_messages=True
-        )
-
         # Setup QA chain
         qa_chain = ConversationalRetrievalChain.from_llm(
             llm=self.llm,
             retriever=retriever,
-            memory=memory,
+            memory=self.setup_memory(),
             return_source_documents=True,
             verbose=False
         )
@@ -106,6 +151,7 @@ class ChatbotWeb:
             st.session_state["websites"] = []
         
         websites = list(set(st.session_state["websites"]))
+        vectordb = self.setup_vectordb(websites)
 
         if not websites:
             st.error("Please enter website url to continue!")
@@ -113,7 +159,6 @@ class ChatbotWeb:
         else:
             st.sidebar.info("Websites - \n - {}".format('\n - '.join(websites)))
 
-            vectordb = self.setup_vectordb(websites)
             qa_chain = self.setup_qa_chain(vectordb)
 
             user_query = st.chat_input(placeholder="Ask me anything!")
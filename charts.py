@@ -0,0 +1,213 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+from sql_utils import quote_identifier
+
+# Line charts with more points than this are drawn with WebGL
+WEBGL_THRESHOLD = 1000
+
+CHART_TITLES = {
+    "pie": "Data Distribution",
+    "line": "Trend Analysis",
+    "bar": "Comparison Chart",
+}
+
+
+def lttb(x, y, n_out):
+    """Largest-Triangle-Three-Buckets downsampling of a line series.
+
+    Returns the indices of the `n_out` points that best preserve the shape
+    of the series. The first and last points are always kept.
+
+    Args:
+        x (ndarray): x values, in increasing order
+        y (ndarray): y values
+        n_out (int): number of points to keep
+    """
+    n = len(x)
+    if n_out >= n or n_out < 3:
+        return np.arange(n)
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    # bucket edges for the points between the first and the last
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    selected = np.empty(n_out, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    prev = 0
+    for i in range(n_out - 2):
+        start, stop = edges[i], edges[i + 1]
+        # average of the next bucket, or the last point for the final bucket
+        next_stop = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = stop if i + 2 < len(edges) else n - 1
+        avg_x = x[next_start:next_stop].mean()
+        avg_y = y[next_start:next_stop].mean()
+        area = np.abs(
+            (x[prev] - avg_x) * (y[start:stop] - y[prev])
+            - (x[prev] - x[start:stop]) * (avg_y - y[prev])
+        )
+        prev = start + int(np.argmax(area))
+        selected[i + 1] = prev
+    return selected
+
+
+def _line_x(series):
+    """Numeric x positions for LTTB, the row position if x is not ordered."""
+    if pd.api.types.is_numeric_dtype(series):
+        x = series.to_numpy(dtype=np.float64)
+    else:
+        try:
+            x = pd.to_datetime(series).to_numpy(dtype="datetime64[ns]").astype(np.int64).astype(np.float64)
+        except (ValueError, TypeError):
+            return np.arange(len(series), dtype=np.float64)
+    if len(x) > 1 and np.any(np.diff(x) < 0):
+        return np.arange(len(series), dtype=np.float64)
+    return x
+
+
+def _pie_frame(df, max_slices):
+    """Sums the values per label, keeping the `max_slices` largest and the rest as "Other"."""
+    label = df.columns[0]
+    if len(df.columns) > 1:
+        values = df.groupby(label, sort=False)[df.columns[1]].sum()
+    else:
+        values = df.groupby(label, sort=False).size().rename("count")
+    values = values.sort_values(ascending=False)
+    if len(values) > max_slices:
+        other = pd.Series([values.iloc[max_slices:].sum()], index=pd.Index(["Other"], name=label), name=values.name)
+        values = pd.concat([values.iloc[:max_slices], other])
+    return values.reset_index()
+
+
+def _downsample_line(df, max_points):
+    if len(df) > max_points and len(df.columns) > 1 and pd.api.types.is_numeric_dtype(df.iloc[:, 1]):
+        keep = lttb(_line_x(df.iloc[:, 0]), df.iloc[:, 1].to_numpy(dtype=np.float64), max_points)
+        df = df.iloc[keep].reset_index(drop=True)
+    return df.iloc[:max_points]
+
+
+def load_chart_data(chart_type, query, read_frame, max_points=2000, max_fetch=100_000, max_slices=10):
+    """Fetches and reduces the data for a chart.
+
+    The query is first read as is, which is usually a result cache hit since
+    the agent has just run it. Only the first two columns are plotted: pie
+    charts are summed per label, keeping the `max_slices` largest and the
+    rest as "Other"; bar charts are capped at `max_points` rows; line charts
+    are downsampled with LTTB to `max_points`. If the result was truncated
+    by the frame row cap, the query is wrapped instead so the aggregation
+    (pie) or thinning to at most `max_fetch` rows (line) runs in SQL.
+
+    `read_frame` marks a truncated result with `df.attrs["truncated"]`.
+
+    Returns the DataFrame to plot and the number of rows the query returns.
+
+    Args:
+        chart_type (str): "bar", "pie" or "line"
+        query (str): SQL query generated by the agent
+        read_frame (callable): runs a query and returns a DataFrame
+        max_points (int): maximum number of bars or line points
+        max_fetch (int): maximum number of rows fetched for a line chart
+        max_slices (int): maximum number of pie slices before "Other"
+    """
+    df = read_frame(query)
+    if df.empty:
+        return df, 0
+    df = df.iloc[:, :2]
+    if not df.attrs.get("truncated", False):
+        if chart_type == "pie":
+            return _pie_frame(df, max_slices), len(df)
+        if chart_type == "line":
+            return _downsample_line(df, max_points), len(df)
+        return df.iloc[:max_points], len(df)
+
+    # newlines around the query, so a trailing "-- comment" cannot swallow the wrapper
+    query = "\n" + query.strip().rstrip(";").rstrip() + "\n"
+    columns = [quote_identifier(col) for col in df.columns]
+    x_col = columns[0]
+    total_rows = int(read_frame(f"SELECT COUNT(*) FROM ({query}) AS q").iloc[0, 0])
+
+    if chart_type == "pie":
+        value = f"SUM({columns[1]})" if len(columns) > 1 else "COUNT(*)"
+        pie = read_frame(
+            f"WITH chart_totals AS (SELECT {x_col} AS label, {value} AS value FROM ({query}) AS q GROUP BY {x_col}), "
+            f"chart_ranked AS (SELECT label, value, ROW_NUMBER() OVER (ORDER BY value DESC) AS rn FROM chart_totals) "
+            f"SELECT label, value FROM chart_ranked WHERE rn <= {int(max_slices)} "
+            f"UNION ALL SELECT 'Other', SUM(value) FROM chart_ranked WHERE rn > {int(max_slices)} HAVING COUNT(*) > 0"
+        )
+        pie.columns = [df.columns[0], df.columns[1] if len(columns) > 1 else "count"]
+        return pie, total_rows
+
+    if chart_type != "line":
+        return df.iloc[:max_points], total_rows
+
+    # keep every stride-th row so at most max_fetch rows leave the database
+    select = ", ".join(columns)
+    stride = -(-total_rows // max_fetch)
+    df = read_frame(
+        f"SELECT {select} FROM (SELECT {select}, ROW_NUMBER() OVER () AS rn FROM ({query}) AS q) "
+        f"WHERE (rn - 1) % {stride} = 0"
+    )
+    return _downsample_line(df, max_points), total_rows
+
+
+class ChartSpec:
+    """Compact description of a chart, kept in the transcript instead of a Figure.
+
+    Only the chart type, the plotted columns and their values are stored.
+    Numeric columns are NumPy arrays, other columns NumPy string arrays. At
+    most `max_rows` rows are kept.
+
+    Args:
+        chart_type (str): "bar", "pie" or "line"
+        df (DataFrame): query result, the first column is the x axis or the
+            pie labels, the second (if any) the values
+        max_rows (int): maximum number of rows stored
+        total_rows (int): rows the query returned before any downsampling,
+            defaults to the rows in `df`
+    """
+
+    def __init__(self, chart_type, df, max_rows=5000, total_rows=None):
+        self.chart_type = chart_type if chart_type in CHART_TITLES else "bar"
+        self.total_rows = len(df) if total_rows is None else total_rows
+        df = df.iloc[:max_rows, :2]
+        self.columns = tuple(str(col) for col in df.columns)
+        self.data = tuple(self._pack(df.iloc[:, i]) for i in range(len(self.columns)))
+        digest = hashlib.sha256(self.chart_type.encode())
+        for name, col in zip(self.columns, self.data):
+            digest.update(name.encode())
+            digest.update(col.dtype.str.encode())
+            digest.update(col.tobytes())
+        self.digest = digest.hexdigest()
+
+    @staticmethod
+    def _pack(series):
+        if pd.api.types.is_bool_dtype(series) or pd.api.types.is_numeric_dtype(series):
+            return series.to_numpy()
+        return series.astype(str).to_numpy(dtype=np.str_)
+
+    @property
+    def truncated(self):
+        return self.total_rows > len(self.data[0]) if self.data else False
+
+    @property
+    def nbytes(self):
+        return sum(col.nbytes for col in self.data)
+
+    def to_frame(self):
+        return pd.DataFrame(dict(zip(self.columns, self.data)))
+
+    def to_figure(self, webgl_threshold=WEBGL_THRESHOLD):
+        df = self.to_frame()
+        x_col = self.columns[0]
+        y_col = self.columns[1] if len(self.columns) > 1 else None
+        title = CHART_TITLES[self.chart_type]
+        if self.truncated and self.chart_type != "pie":
+            title += f" ({len(df)} of {self.total_rows} rows shown)"
+        if self.chart_type == "pie":
+            return px.pie(df, names=x_col, values=y_col, title=title)
+        if self.chart_type == "line":
+            render_mode = "webgl" if len(df) > webgl_threshold else "svg"
+            return px.line(df, x=x_col, y=y_col, title=title, render_mode=render_mode)
+        return px.bar(df, x=x_col, y=y_col, title=title)
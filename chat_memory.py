@@ -0,0 +1,57 @@
+import re
+from typing import Any, Dict, List
+
+from langchain.memory import ConversationSummaryBufferMemory
+from langchain_core.messages import BaseMessage, get_buffer_string
+
+# Python reprs of result rows, e.g. "[('AC/DC', 10), ('Accept', 2)]"
+SQL_ROWS = re.compile(r"\[\([^\[\]]*\)\]")
+
+
+class BoundedConversationMemory(ConversationSummaryBufferMemory):
+    """Conversation memory with a token budget.
+
+    The last `keep_last` exchanges are always kept verbatim. Older messages
+    are folded into a rolling summary once the buffer exceeds
+    `max_token_limit` tokens. Raw SQL result rows are dropped from saved
+    messages and each message is capped at `max_message_chars` characters.
+    """
+
+    keep_last: int = 2
+    max_message_chars: int = 2000
+
+    def _compact(self, text):
+        text = SQL_ROWS.sub("[rows omitted]", text)
+        if len(text) > self.max_message_chars:
+            text = text[:self.max_message_chars] + " [truncated]"
+        return text
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        input_str, output_str = self._get_input_output(inputs, outputs)
+        self.chat_memory.add_user_message(self._compact(input_str))
+        self.chat_memory.add_ai_message(self._compact(output_str))
+        self.prune()
+
+    def prune(self) -> None:
+        buffer = self.chat_memory.messages
+        protected = 2 * self.keep_last
+        curr_buffer_length = self.llm.get_num_tokens_from_messages(buffer)
+        pruned_memory = []
+        while curr_buffer_length > self.max_token_limit and len(buffer) > protected:
+            # drop whole exchanges so the buffer always starts with a question
+            pruned_memory.extend(buffer[:2])
+            del buffer[:2]
+            curr_buffer_length = self.llm.get_num_tokens_from_messages(buffer)
+        if pruned_memory:
+            self.moving_summary_buffer = self.predict_new_summary(
+                pruned_memory, self.moving_summary_buffer
+            )
+
+    def predict_new_summary(self, messages: List[BaseMessage], existing_summary: str) -> str:
+        new_lines = get_buffer_string(
+            messages, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix
+        )
+        prompt = self.prompt.format(summary=existing_summary, new_lines=new_lines)
+        # no callbacks, so the summary is not streamed into the chat bubble
+        summary = self.llm.invoke(prompt, config={"callbacks": []})
+        return getattr(summary, "content", summary)
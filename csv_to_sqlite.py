@@ -1,35 +1,171 @@
-import pandas as pd
+import os
+import time
 import sqlite3
+import argparse
+from itertools import chain
+
+import pandas as pd
+
+from sql_utils import quote_identifier
+
+# Only applied to the importing connection, for the length of the load
+LOAD_PRAGMAS = {
+    "synchronous": "NORMAL",
+    "cache_size": -256 * 1024,  # KiB, i.e. 256 MiB
+    "temp_store": "MEMORY",
+}
+
+# Without a journal on disk or fsyncs a crash can corrupt the database, which is
+# only acceptable when it is a new file that can simply be rebuilt
+NEW_FILE_PRAGMAS = {
+    **LOAD_PRAGMAS,
+    "journal_mode": "MEMORY",
+    "synchronous": "OFF",
+}
+
 
-def csv_to_sqlite_pandas(csv_file, db_file, table_name):
+def sqlite_type(dtype):
+    """SQLite column type for a pandas dtype."""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    return "TEXT"
+
+
+def _rows(chunk):
+    # Python objects with None for missing values, which is what sqlite3 binds
+    chunk = chunk.astype(object)
+    return chunk.where(chunk.notna(), None).itertuples(index=False, name=None)
+
+
+def csv_to_sqlite_pandas(csv_file, db_file, table_name, mode="replace", key=None, dtype=None,
+                         indexes=(), chunksize=50_000):
     """
-    Convert a CSV file to an SQLite database table using pandas.
+    Load a CSV file into an SQLite database table, one chunk at a time.
+
+    The file is streamed in chunks of `chunksize` rows, so memory use does not
+    depend on the file size. Column types are taken from `dtype` or inferred
+    from the first chunk. All chunks are inserted in a single transaction
+    with bulk-load PRAGMAs, and the indexes are created once the rows are in.
+    Journaling and fsyncs are only turned off when 'replace' creates a new
+    file; loads into an existing database stay crash-safe.
 
     Args:
         csv_file (str): Path to the input CSV file.
         db_file (str): Path to the output SQLite database file (.db).
-        table_name (str): Name for the new table in the database.
+        table_name (str): Name of the table in the database.
+        mode (str): 'replace' drops and recreates the table, 'append' inserts
+            rows whose key is not in the table yet, 'upsert' also updates the
+            rows whose key is.
+        key (str): Key column, required for 'upsert'. Gets a unique index.
+        dtype (dict): Column name to pandas dtype, overrides inference.
+        indexes (iterable): Columns to create a (non-unique) index on.
+        chunksize (int): Number of rows read and inserted at a time.
+
+    Returns:
+        int: number of rows read from the CSV file.
     """
+    if mode not in ("replace", "append", "upsert"):
+        raise ValueError(f"Unknown mode: {mode}")
+    if mode == "upsert" and key is None:
+        raise ValueError("upsert needs a key column")
+
+    table = quote_identifier(table_name)
+    chunks = pd.read_csv(csv_file, dtype=dtype, chunksize=chunksize)
+    first = next(chunks, None)
+    if first is None:
+        # no chunk for a file with only a header, the table is still created or replaced
+        first = pd.read_csv(csv_file, dtype=dtype, nrows=0)
+    columns = [quote_identifier(col) for col in first.columns]
+    if key is not None and key not in first.columns:
+        raise ValueError(f"Key column {key!r} is not in {csv_file}")
+
+    insert = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    if mode == "append" and key is not None:
+        insert = insert.replace("INSERT", "INSERT OR IGNORE", 1)
+    elif mode == "upsert":
+        updates = ", ".join(f"{col} = excluded.{col}" for col in columns if col != quote_identifier(key))
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        insert += f" ON CONFLICT ({quote_identifier(key)}) {action}"
+    key_index = f"CREATE UNIQUE INDEX IF NOT EXISTS {quote_identifier(f'ux_{table_name}_{key}')} ON {table} ({quote_identifier(key)})"
+
+    # The database keeps its own journal mode (rollback or WAL) unless it is
+    # being created by this load
+    new_file = not os.path.exists(db_file) or os.path.getsize(db_file) == 0
+    pragmas = NEW_FILE_PRAGMAS if mode == "replace" and new_file else LOAD_PRAGMAS
+
+    # autocommit mode, so the transaction is exactly the one opened below
+    conn = sqlite3.connect(db_file, isolation_level=None)
     try:
-        # Read the CSV file into a pandas DataFrame
-        df = pd.read_csv(csv_file)
-        
-        # Connect to the SQLite database (it will be created if it doesn't exist)
-        conn = sqlite3.connect(db_file)
-        
-        # Write the data to a new SQLite table
-        # if_exists='replace' will drop the table if it already exists and create a new one
-        # index=False prevents pandas from writing the DataFrame index as a column
-        df.to_sql(table_name, conn, if_exists='replace', index=False)
-        
-        # Commit changes and close the connection
-        conn.commit()
+        for name, value in pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        conn.execute("BEGIN")
+        try:
+            if mode == "replace":
+                conn.execute(f"DROP TABLE IF EXISTS {table}")
+            column_defs = ", ".join(f"{col} {sqlite_type(t)}" for col, t in zip(columns, first.dtypes))
+            conn.execute(f"CREATE TABLE IF NOT EXISTS {table} ({column_defs})")
+            if key is not None and mode != "replace":
+                # conflicts are detected through the unique index, so it has to exist before the load
+                conn.execute(key_index)
+
+            num_rows = 0
+            for chunk in chain([first], chunks):
+                conn.executemany(insert, _rows(chunk))
+                num_rows += len(chunk)
+
+            if key is not None and mode == "replace":
+                conn.execute(key_index)
+            for column in indexes:
+                index_name = quote_identifier(f"ix_{table_name}_{column}")
+                conn.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({quote_identifier(column)})")
+            conn.execute(f"ANALYZE {table}")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
         conn.close()
-        
-        print(f"Successfully converted '{csv_file}' to table '{table_name}' in '{db_file}'")
-    
-    except Exception as e:
-        print(f"An error occurred: {e}")
-
-# Example usage:
-csv_to_sqlite_pandas('assets/sheet.csv', 'assets/my_database.db', 'my_thanks')
+    return num_rows
+
+
+def _parse_dtypes(specs):
+    dtype = {}
+    for spec in specs:
+        column, sep, value = spec.partition("=")
+        if not sep:
+            raise argparse.ArgumentTypeError(f"expected column=dtype, got {spec!r}")
+        dtype[column] = value
+    return dtype
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a CSV file into an SQLite table in chunks.")
+    parser.add_argument("csv_file", help="path to the input CSV file")
+    parser.add_argument("db_file", help="path to the SQLite database, created if missing")
+    parser.add_argument("table_name", help="table to load the rows into")
+    parser.add_argument("--mode", choices=["replace", "append", "upsert"], default="replace")
+    parser.add_argument("--key", help="key column for append and upsert, gets a unique index")
+    parser.add_argument("--dtype", action="append", default=[], metavar="COLUMN=DTYPE",
+                        help="pandas dtype of a column, e.g. price=float64, may be repeated")
+    parser.add_argument("--index", action="append", default=[], metavar="COLUMN",
+                        help="column to index after the load, may be repeated")
+    parser.add_argument("--chunksize", type=int, default=50_000, help="rows per chunk")
+    args = parser.parse_args()
+
+    try:
+        dtype = _parse_dtypes(args.dtype) or None
+        start = time.perf_counter()
+        num_rows = csv_to_sqlite_pandas(
+            args.csv_file, args.db_file, args.table_name,
+            mode=args.mode, key=args.key, dtype=dtype, indexes=args.index, chunksize=args.chunksize
+        )
+    except (argparse.ArgumentTypeError, ValueError, OSError, sqlite3.Error) as e:
+        parser.exit(1, f"An error occurred: {e}\n")
+    print(f"Loaded {num_rows} rows from '{args.csv_file}' into table '{args.table_name}' "
+          f"in '{args.db_file}' in {time.perf_counter() - start:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import os
+import re
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import tempfile
+import threading
+import statistics
+from pathlib import Path
+from collections import Counter
+
+import sql_utils
+from sql_utils import quote_identifier, unquote_identifier, mask_strings, table_aliases
+
+_PLAN_SCAN = re.compile(r"^SCAN (?:TABLE )?(\S+)(?: AS (\S+))?(.*)$")
+_COLUMN_REF = re.compile(r"(?:(\"[^\"]+\"|\w+)\s*\.\s*)?(\"[^\"]+\"|\[[^\]]+\]|`[^`]+`|\w+)")
+_ORDERING = re.compile(r"\b(?:GROUP|ORDER)\s+BY\s+(.+?)(?=\bLIMIT\b|\bHAVING\b|\bORDER\b|\)|$)", re.IGNORECASE | re.DOTALL)
+_COMPARISON = r"\s*(?:=|==|!=|<>|<=|>=|<|>|\bIN\b|\bLIKE\b|\bBETWEEN\b|\bIS\b)"
+
+
+class QueryLog:
+    """Appends every query the app runs to a JSON-lines file.
+
+    The log is the workload the index advisor replays. Once the file grows
+    past `max_bytes` it is rotated to `<path>.1`.
+
+    Args:
+        path (str): log file, created with its folder if missing
+        max_bytes (int): size at which the log is rotated
+    """
+
+    def __init__(self, path, max_bytes=64 * 1024 * 1024):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def record(self, query, seconds, cached=False):
+        entry = json.dumps({"query": sql_utils.normalize_sql(query), "ms": round(seconds * 1000, 3), "cached": cached})
+        with self._lock:
+            if self.path.exists() and self.path.stat().st_size > self.max_bytes:
+                os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+            with open(self.path, "a") as f:
+                f.write(entry + "\n")
+
+
+def load_workload(log_path):
+    """Counts how often each distinct read query appears in a query log."""
+    workload = Counter()
+    with open(log_path) as f:
+        for line in f:
+            try:
+                query = json.loads(line)["query"]
+            except (ValueError, KeyError):
+                continue
+            if query.lstrip().upper().startswith(("SELECT", "WITH")):
+                workload[query] += 1
+    return workload
+
+
+def query_plan(conn, query):
+    """Returns the detail lines of `EXPLAIN QUERY PLAN` for a query."""
+    return [row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}")]
+
+
+def plan_issues(plan):
+    """Full table scans and temp B-trees in a query plan.
+
+    Returns a list of (kind, name) pairs, kind being "scan" (name is the
+    table or alias scanned) or "temp b-tree" (name is what it is built for).
+    """
+    issues = []
+    for detail in plan:
+        match = _PLAN_SCAN.match(detail)
+        if match and "INDEX" not in match.group(3):
+            issues.append(("scan", match.group(2) or match.group(1)))
+        elif detail.startswith("USE TEMP B-TREE"):
+            issues.append(("temp b-tree", detail[len("USE TEMP B-TREE FOR "):]))
+    return issues
+
+
+class IndexAdvisor:
+    """Proposes indexes for a SQLite database from a recorded workload.
+
+    Queries are explained against the database. For every table a query
+    scans, or sorts in a temp B-tree, two candidates are built from the
+    columns the query uses: one on the filtered, joined and sorted columns,
+    and one that also covers the selected columns. Each candidate is created
+    on a scratch copy of the database and the workload is timed with and
+    without it, so candidates are ranked by measured benefit, weighted by how
+    often each query was logged.
+
+    Args:
+        db_filepath (str | Path): database the workload ran against
+        workload (Counter): query text to number of executions
+        repeats (int): timed runs per query, the median is used
+        max_columns (int): widest index proposed
+    """
+
+    def __init__(self, db_filepath, workload, repeats=5, max_columns=6):
+        self.db_filepath = Path(db_filepath)
+        self.workload = workload
+        self.repeats = repeats
+        self.max_columns = max_columns
+        conn = sqlite3.connect(f"file:{self.db_filepath}?mode=ro", uri=True)
+        try:
+            tables = [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")]
+            self.columns = {
+                table: [row[1] for row in conn.execute(f"PRAGMA table_info({quote_identifier(table)})")]
+                for table in tables if not table.startswith("sqlite_")
+            }
+            self.plans = {}
+            for query in workload:
+                try:
+                    self.plans[query] = query_plan(conn, query)
+                except sqlite3.Error:
+                    # queries against an older schema or that never ran successfully
+                    continue
+        finally:
+            conn.close()
+
+    def report(self):
+        """(query, count, issues) for every query with a scan or temp B-tree."""
+        rows = []
+        for query, plan in self.plans.items():
+            issues = plan_issues(plan)
+            if issues:
+                rows.append((query, self.workload[query], issues))
+        return sorted(rows, key=lambda row: -row[1])
+
+    def _aliases(self, query):
+        return table_aliases(query, self.columns)
+
+    def _table_columns(self, query, table, aliases):
+        """Columns of `table` a query uses, as (key columns, other columns)."""
+        text = mask_strings(query)
+        table_cols = {col.lower(): col for col in self.columns[table]}
+        # unqualified names that another table in the query also has are ambiguous
+        ambiguous = {
+            col.lower() for other in set(aliases.values()) - {table} for col in self.columns[other]
+        }
+
+        def columns_in(fragment):
+            found = []
+            for qualifier, name in _COLUMN_REF.findall(fragment):
+                name = unquote_identifier(name).lower()
+                col = table_cols.get(name)
+                if col is None or col in found:
+                    continue
+                if qualifier and aliases.get(unquote_identifier(qualifier).lower()) != table:
+                    continue
+                if not qualifier and name in ambiguous:
+                    continue
+                found.append(col)
+            return found
+
+        keys = []
+        for match in re.finditer(rf"((?:(?:\"[^\"]+\"|\w+)\s*\.\s*)?(?:\"[^\"]+\"|\w+)){_COMPARISON}", text, re.IGNORECASE):
+            keys += [c for c in columns_in(match.group(1)) if c not in keys]
+        for match in re.finditer(rf"(?:=|==)\s*((?:(?:\"[^\"]+\"|\w+)\s*\.\s*)?(?:\"[^\"]+\"|\w+))", text):
+            keys += [c for c in columns_in(match.group(1)) if c not in keys]
+        for match in _ORDERING.finditer(text):
+            keys += [c for c in columns_in(match.group(1)) if c not in keys]
+        others = [c for c in columns_in(text) if c not in keys]
+        return keys, others
+
+    def candidates(self):
+        """Candidate indexes as (table, columns) tuples, with the queries they target."""
+        targets = {}
+        for query, count, issues in self.report():
+            aliases = self._aliases(query)
+            tables = {aliases.get(name.lower()) for kind, name in issues if kind == "scan"}
+            if any(kind == "temp b-tree" for kind, _ in issues):
+                tables.update(aliases.values())
+            for table in tables - {None}:
+                keys, others = self._table_columns(query, table, aliases)
+                if not keys:
+                    continue
+                for columns in (keys, keys + others):
+                    columns = tuple(columns[:self.max_columns])
+                    targets.setdefault((table, columns), set()).add(query)
+        return targets
+
+    def _time(self, conn, query):
+        timings = []
+        for _ in range(self.repeats):
+            start = time.perf_counter()
+            conn.execute(query).fetchall()
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
+
+    def propose(self, min_benefit_ms=0.1):
+        """Candidates ranked by measured benefit over the workload.
+
+        Returns dicts with the table, columns, CREATE INDEX statement, the
+        workload milliseconds saved and the seconds the index took to build.
+        Candidates saving less than `min_benefit_ms` are dropped, as are those
+        that share their leading columns with a better index.
+        """
+        targets = self.candidates()
+        if not targets:
+            return []
+        with tempfile.TemporaryDirectory() as scratch:
+            scratch_db = Path(scratch) / self.db_filepath.name
+            shutil.copyfile(self.db_filepath, scratch_db)
+            conn = sqlite3.connect(scratch_db)
+            try:
+                conn.execute("ANALYZE")
+                # any query on the table may change plan, not only the targeted ones
+                tables = {table for table, _ in targets}
+                affected = {table: [] for table in tables}
+                for query in self.plans:
+                    for table in tables & set(self._aliases(query).values()):
+                        affected[table].append(query)
+                baseline = {query: self._time(conn, query) for queries in affected.values() for query in queries}
+
+                proposals = []
+                for table, columns in targets:
+                    name = quote_identifier(index_name(table, columns))
+                    statement = create_index_statement(table, columns)
+                    start = time.perf_counter()
+                    conn.execute(statement)
+                    build_seconds = time.perf_counter() - start
+                    conn.execute(f"ANALYZE {name}")
+                    saved = sum(
+                        self.workload[query] * (baseline[query] - self._time(conn, query))
+                        for query in affected[table]
+                    )
+                    conn.execute(f"DROP INDEX {name}")
+                    proposals.append({
+                        "table": table,
+                        "columns": columns,
+                        "statement": statement,
+                        "saved_ms": saved * 1000,
+                        "build_seconds": build_seconds,
+                    })
+            finally:
+                conn.close()
+
+        chosen = []
+        for proposal in sorted(proposals, key=lambda p: -p["saved_ms"]):
+            if proposal["saved_ms"] < min_benefit_ms:
+                break
+            # the leading columns of the better index already serve the same lookups
+            n = len(proposal["columns"])
+            if any(
+                p["table"] == proposal["table"] and p["columns"][:n] == proposal["columns"][:len(p["columns"])]
+                for p in chosen
+            ):
+                continue
+            chosen.append(proposal)
+        return chosen
+
+
+def index_name(table, columns):
+    return f"ix_{table}_{'_'.join(columns)}"[:60]
+
+
+def create_index_statement(table, columns):
+    cols = ", ".join(quote_identifier(col) for col in columns)
+    return f"CREATE INDEX IF NOT EXISTS {quote_identifier(index_name(table, columns))} ON {quote_identifier(table)} ({cols})"
+
+
+def write_script(proposals, script_path):
+    lines = ["-- Indexes proposed by index_advisor.py, apply to an offline copy of the database"]
+    for p in proposals:
+        lines.append(f"-- saves {p['saved_ms']:.1f} ms over the recorded workload, built in {p['build_seconds']:.2f}s")
+        lines.append(p["statement"] + ";")
+    lines.append("ANALYZE;")
+    Path(script_path).write_text("\n".join(lines) + "\n")
+
+
+def apply_script(db_filepath, script_path, output_path):
+    """Writes a copy of the database with the script applied to `output_path`.
+
+    The source database is only read, through the backup API, so the copy is
+    consistent even while the app has it open.
+    """
+    if Path(output_path).resolve() == Path(db_filepath).resolve():
+        raise ValueError("the output must be a new file, the source database is never modified")
+    src = sqlite3.connect(f"file:{db_filepath}?mode=ro", uri=True)
+    dst = sqlite3.connect(output_path)
+    try:
+        src.backup(dst)
+        dst.executescript(Path(script_path).read_text())
+        dst.execute("VACUUM")
+    finally:
+        src.close()
+        dst.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Propose and apply indexes for a SQLite database from its query log.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    report = subparsers.add_parser("report", help="list logged queries with full scans or temp B-trees")
+    propose = subparsers.add_parser("propose", help="rank candidate indexes and write an apply script")
+    for sub in (report, propose):
+        sub.add_argument("db_file", help="SQLite database the workload ran against")
+        sub.add_argument("--log", default=".cache/query_log.jsonl", help="query log written by the app")
+    propose.add_argument("--out", default="indexes.sql", help="apply script to write")
+    propose.add_argument("--repeats", type=int, default=5, help="timed runs per query")
+    propose.add_argument("--min-benefit-ms", type=float, default=0.1)
+    apply = subparsers.add_parser("apply", help="write a copy of the database with an apply script run on it")
+    apply.add_argument("db_file", help="SQLite database to copy, it is not modified")
+    apply.add_argument("script", help="script written by the propose command")
+    apply.add_argument("--output", required=True, help="path of the new database file")
+    args = parser.parse_args()
+
+    if args.command == "apply":
+        start = time.perf_counter()
+        apply_script(args.db_file, args.script, args.output)
+        size_mb = os.path.getsize(args.output) / 1024 / 1024
+        print(f"Wrote {args.output} ({size_mb:.1f} MiB) in {time.perf_counter() - start:.1f}s")
+        return
+
+    advisor = IndexAdvisor(args.db_file, load_workload(args.log), repeats=getattr(args, "repeats", 5))
+    if args.command == "report":
+        for query, count, issues in advisor.report():
+            print(f"{count:>6}x  {query}")
+            for kind, name in issues:
+                print(f"         {kind}: {name}")
+        return
+
+    proposals = advisor.propose(min_benefit_ms=args.min_benefit_ms)
+    write_script(proposals, args.out)
+    print(f"{'saved ms':>10}  index")
+    for p in proposals:
+        print(f"{p['saved_ms']:>10.1f}  {p['statement']}")
+    print(f"Wrote {len(proposals)} indexes to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
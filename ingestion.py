@@ -0,0 +1,177 @@
+import os
+import time
+import threading
+import multiprocessing
+from io import BytesIO
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+from pypdf import PdfReader
+from streamlit.logger import get_logger
+
+from pdf_pages import read_page, parse_shared_range
+
+logger = get_logger('Langchain-Chatbot')
+
+
+class IngestionStats:
+    """Items processed and seconds spent per ingestion stage."""
+
+    def __init__(self):
+        self.stages = {}
+        self.started_at = time.perf_counter()
+
+    def add(self, stage, items, seconds):
+        entry = self.stages.setdefault(stage, {"items": 0, "seconds": 0.0})
+        entry["items"] += items
+        entry["seconds"] += seconds
+
+    def report(self):
+        lines = [f"Ingestion finished in {time.perf_counter() - self.started_at:.2f}s"]
+        for stage, entry in self.stages.items():
+            rate = entry["items"] / entry["seconds"] if entry["seconds"] else float("inf")
+            lines.append(f"  {stage}: {entry['items']} items in {entry['seconds']:.2f}s ({rate:.1f}/s)")
+        return "\n".join(lines)
+
+
+def _pool_context():
+    # fork would copy the whole Streamlit server into every worker
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class PdfParsePool:
+    """Long-lived process pool for parsing large PDFs.
+
+    Workers are started on the first file with at least `min_pages` pages
+    and are kept for later uploads, so their startup is paid once per
+    process. Smaller files are parsed in the calling process, where a pool
+    costs more than it saves.
+
+    Args:
+        max_workers (int): number of worker processes, defaults to the CPU count
+        min_pages (int): smallest file, in pages, parsed in the pool
+    """
+
+    def __init__(self, max_workers=None, min_pages=64):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_pages = min_pages
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def use_for(self, num_pages):
+        return self.max_workers > 1 and num_pages >= self.min_pages
+
+    def submit(self, fn, *args):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=_pool_context())
+            return self._executor.submit(fn, *args)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+def iter_pdf_pages(files, stats, pool=None, pages_per_task=16):
+    """Yields the pages of uploaded PDFs as they are parsed.
+
+    Files are taken from `files` one at a time, so it can be a generator
+    and only the files being parsed are held in memory. Files that `pool`
+    takes are copied once into shared memory and split into ranges of
+    `pages_per_task` pages, with at most two ranges per worker in flight,
+    so pages can be split and embedded while the rest are still being
+    parsed. Tasks only carry the name of the shared block, and it is
+    released as soon as the file's last range is parsed. Other files are
+    parsed in this process, page by page.
+
+    Args:
+        files (iterable): (name, bytes) pairs of the PDF files to load
+        stats (IngestionStats): collects the time spent parsing
+        pool (PdfParsePool): pool for large files, None parses everything here
+        pages_per_task (int): number of pages parsed per task
+    """
+    blocks = {}  # shared block name -> [block, ranges not parsed yet]
+    pending = {}  # future -> shared block name
+
+    def collect(max_pending=None):
+        # yields the parsed ranges, waiting while more than max_pending are in flight
+        while pending:
+            done = [future for future in pending if future.done()]
+            if not done:
+                if max_pending is None or len(pending) <= max_pending:
+                    return
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                block = blocks[pending.pop(future)]
+                block[1] -= 1
+                if block[1] == 0:
+                    del blocks[block[0].name]
+                    block[0].close()
+                    block[0].unlink()
+                docs, seconds = future.result()
+                stats.add("parse", len(docs), seconds)
+                yield from docs
+
+    try:
+        for name, data in files:
+            reader = PdfReader(BytesIO(data))
+            num_pages = len(reader.pages)
+            if pool is None or not pool.use_for(num_pages):
+                # parsed here while the pool works on earlier files
+                for page_num in range(num_pages):
+                    begin = time.perf_counter()
+                    page = read_page(reader, name, page_num)
+                    stats.add("parse", 1, time.perf_counter() - begin)
+                    yield page
+                    yield from collect()
+                continue
+            del reader
+            shm = shared_memory.SharedMemory(create=True, size=len(data))
+            shm.buf[:len(data)] = data
+            ranges = range(0, num_pages, pages_per_task)
+            blocks[shm.name] = [shm, len(ranges)]
+            for start in ranges:
+                yield from collect(2 * pool.max_workers - 1)
+                task = (name, shm.name, len(data), start, min(start + pages_per_task, num_pages))
+                pending[pool.submit(parse_shared_range, *task)] = shm.name
+        yield from collect(0)
+    finally:
+        for future in pending:
+            future.cancel()
+        for shm, _ in blocks.values():
+            shm.close()
+            shm.unlink()
+
+
+def ingest_documents(documents, vectordb, text_splitter, stats, batch_size=64):
+    """Splits documents as they arrive and adds them to `vectordb` in batches.
+
+    Args:
+        documents (iterable): documents to index, may be a generator
+        vectordb (VectorStore): store the chunks are embedded into
+        text_splitter (TextSplitter): splitter applied to each document
+        stats (IngestionStats): collects the time spent splitting and embedding
+        batch_size (int): number of chunks embedded per call
+    """
+    def embed(batch):
+        start = time.perf_counter()
+        vectordb.add_documents(batch)
+        stats.add("embed", len(batch), time.perf_counter() - start)
+
+    batch = []
+    for doc in documents:
+        start = time.perf_counter()
+        splits = text_splitter.split_documents([doc])
+        stats.add("split", len(splits), time.perf_counter() - start)
+        batch.extend(splits)
+        while len(batch) >= batch_size:
+            embed(batch[:batch_size])
+            del batch[:batch_size]
+    if batch:
+        embed(batch)
+
+    logger.info(stats.report())
+    return vectordb
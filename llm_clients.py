@@ -0,0 +1,90 @@
+import threading
+from collections import OrderedDict
+
+import httpx
+from langchain_openai import ChatOpenAI, AzureChatOpenAI
+
+from model_catalog import key_hash
+
+
+class LLMClientRegistry:
+    """Process-wide registry of chat model clients.
+
+    Clients are created once per provider, endpoint, deployment, model and
+    API key, and all of them send requests through one shared httpx
+    connection pool, so keep-alive and TLS sessions are reused across reruns
+    and sessions. At most `max_clients` clients are kept, least recently
+    used first out, as every API key typed into the sidebar adds one.
+
+    Args:
+        max_connections (int): maximum open connections in the shared pool
+        max_keepalive_connections (int): maximum idle connections kept open
+        keepalive_expiry (float): seconds an idle connection is kept open
+        timeout (float): request timeout in seconds
+        max_clients (int): maximum number of clients kept
+    """
+
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=60, timeout=120,
+                 max_clients=32):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        self.http_client = httpx.Client(limits=self.limits, timeout=timeout)
+        self.max_clients = max_clients
+        self._clients = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, provider, model=None, endpoint=None, deployment=None, api_key=None, **kwargs):
+        """Returns the shared client for a model, creating it on first use.
+
+        Args:
+            provider (str): "openai" or "azure"
+            model (str): model name, for OpenAI
+            endpoint (str): resource endpoint, for Azure
+            deployment (str): deployment name, for Azure
+            api_key (str): API key, only its hash is part of the registry key
+            **kwargs: further client settings, e.g. temperature or streaming
+        """
+        key = (provider, endpoint, deployment, model, key_hash(api_key or ""), tuple(sorted(kwargs.items())))
+        with self._lock:
+            if key not in self._clients:
+                if provider == "openai":
+                    client = ChatOpenAI(model_name=model, api_key=api_key, http_client=self.http_client, **kwargs)
+                elif provider == "azure":
+                    client = AzureChatOpenAI(
+                        azure_deployment=deployment,
+                        azure_endpoint=endpoint,
+                        api_key=api_key,
+                        http_client=self.http_client,
+                        **kwargs
+                    )
+                else:
+                    raise ValueError(f"Unknown LLM provider: {provider}")
+                self._clients[key] = client
+                # evicted clients only drop their settings, the connection pool is shared
+                while len(self._clients) > self.max_clients:
+                    self._clients.popitem(last=False)
+            self._clients.move_to_end(key)
+            return self._clients[key]
+
+    def pool_stats(self):
+        """Returns the number of clients and the state of the shared connection pool.
+
+        Connection counts come from httpx's transport internals and are left
+        out if those change.
+        """
+        with self._lock:
+            stats = {"clients": len(self._clients)}
+        stats["max_connections"] = self.limits.max_connections
+        stats["max_keepalive_connections"] = self.limits.max_keepalive_connections
+        try:
+            connections = list(self.http_client._transport._pool.connections)
+            idle = sum(1 for conn in connections if conn.is_idle())
+        except AttributeError:
+            return stats
+        stats["connections"] = len(connections)
+        stats["idle_connections"] = idle
+        stats["active_connections"] = len(connections) - idle
+        return stats
@@ -0,0 +1,73 @@
+import time
+import hashlib
+import threading
+from datetime import datetime
+
+import openai
+from streamlit.logger import get_logger
+
+logger = get_logger('Langchain-Chatbot')
+
+
+def key_hash(api_key):
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+
+class ModelCatalog:
+    """Caches the GPT models available to each OpenAI API key.
+
+    The catalog is keyed by a hash of the key, so keys are never kept as
+    dictionary keys. Once an entry is older than `ttl` seconds it is still
+    served, while a background thread fetches a fresh copy. Only the first
+    lookup for a key waits on the network. Clients send requests through
+    `http_client` when one is given.
+    """
+
+    def __init__(self, ttl=3600, http_client=None):
+        self.ttl = ttl
+        self.http_client = http_client
+        self._entries = {}
+        self._clients = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def client(self, api_key):
+        """Returns the shared `openai.OpenAI` client for an API key."""
+        h = key_hash(api_key)
+        with self._lock:
+            if h not in self._clients:
+                self._clients[h] = openai.OpenAI(api_key=api_key, http_client=self.http_client)
+            return self._clients[h]
+
+    def _fetch(self, api_key):
+        available_models = [{"id": i.id, "created":datetime.fromtimestamp(i.created)} for i in self.client(api_key).models.list() if str(i.id).startswith("gpt")]
+        available_models = sorted(available_models, key=lambda x: x["created"])
+        return [i["id"] for i in available_models]
+
+    def _refresh(self, api_key, h):
+        try:
+            models = self._fetch(api_key)
+            with self._lock:
+                self._entries[h] = (time.monotonic(), models)
+        except Exception as e:
+            logger.warning(f"Could not refresh the OpenAI model catalog: {e}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(h)
+
+    def models(self, api_key):
+        """Returns the ids of the GPT models for a key, oldest first."""
+        h = key_hash(api_key)
+        with self._lock:
+            entry = self._entries.get(h)
+            stale = entry is not None and time.monotonic() - entry[0] > self.ttl
+            if stale and h not in self._refreshing:
+                self._refreshing.add(h)
+                threading.Thread(target=self._refresh, args=(api_key, h), daemon=True).start()
+        if entry is not None:
+            return entry[1]
+
+        models = self._fetch(api_key)
+        with self._lock:
+            self._entries[h] = (time.monotonic(), models)
+        return models
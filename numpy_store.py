@@ -0,0 +1,249 @@
+import json
+import uuid
+from pathlib import Path
+from typing import Any, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from ann_index import IVFIndex, top_k
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1
+    return vectors / norms
+
+
+def mmr(query_sims, candidate_sims, k, lambda_mult):
+    """Greedy maximal marginal relevance over a block of candidates.
+
+    Args:
+        query_sims (np.ndarray): similarity of each candidate to the query
+        candidate_sims (np.ndarray): pairwise similarities of the candidates
+        k (int): number of candidates to select
+        lambda_mult (float): 1 for pure relevance, 0 for pure diversity
+
+    Returns the positions of the selected candidates, in selection order.
+    """
+    n = len(query_sims)
+    k = min(k, n)
+    selected = []
+    max_sim_to_selected = np.full(n, -np.inf, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    for _ in range(k):
+        redundancy = np.where(np.isfinite(max_sim_to_selected), max_sim_to_selected, 0)
+        scores = lambda_mult * query_sims - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        max_sim_to_selected = np.maximum(max_sim_to_selected, candidate_sims[:, best])
+    return selected
+
+
+class NumpyVectorStore(VectorStore):
+    """In-memory vector store backed by a single float32 matrix.
+
+    Rows are L2-normalized on insert, so cosine similarity against all
+    documents is one matrix-vector product. The matrix grows by doubling its
+    capacity and can be saved to and memory-mapped from an `.npy` file.
+
+    With an `index` set (see `build_index`), searches only score the rows in
+    the index's nearest lists plus any rows added after it was built. Pass
+    `exact=True` or `n_probe` through a retriever's `search_kwargs` to choose
+    between exact and approximate search per retriever.
+    """
+
+    def __init__(self, embedding: Embeddings):
+        self.embedding = embedding
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._size = 0
+        self.docs = []
+        self.ids = []
+        self.index = None
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self.embedding
+
+    @property
+    def matrix(self):
+        """The embeddings currently stored, one row per document."""
+        return self._matrix[:self._size]
+
+    def __len__(self):
+        return self._size
+
+    def _append(self, vectors):
+        needed = self._size + len(vectors)
+        if self._matrix.shape[1] != vectors.shape[1] or needed > len(self._matrix) or not self._matrix.flags.writeable:
+            capacity = max(needed, 2 * len(self._matrix), 64)
+            grown = np.empty((capacity, vectors.shape[1]), dtype=np.float32)
+            if self._size:
+                grown[:self._size] = self._matrix[:self._size]
+            self._matrix = grown
+        self._matrix[self._size:needed] = vectors
+        self._size = needed
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        self._append(_normalize(self.embedding.embed_documents(texts)))
+        for text, metadata, doc_id in zip(texts, metadatas, ids):
+            self.docs.append(Document(page_content=text, metadata=metadata, id=doc_id))
+            self.ids.append(doc_id)
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if ids is None:
+            self._matrix = np.empty((0, 0), dtype=np.float32)
+            self._size = 0
+            self.docs, self.ids = [], []
+            self.index = None
+            return True
+        to_delete = set(ids)
+        keep = np.array([doc_id not in to_delete for doc_id in self.ids], dtype=bool)
+        if keep.all():
+            return False
+        # row numbers shift, so the index no longer matches the matrix
+        self.index = None
+        self._matrix = np.ascontiguousarray(self.matrix[keep])
+        self._size = len(self._matrix)
+        self.docs = [doc for doc, kept in zip(self.docs, keep) if kept]
+        self.ids = [doc_id for doc_id, kept in zip(self.ids, keep) if kept]
+        return True
+
+    def build_index(self, n_clusters=None, n_probe=8, **kwargs):
+        """Builds an IVF index over the stored embeddings, see `ann_index.IVFIndex`."""
+        self.index = IVFIndex.build(self.matrix, n_clusters=n_clusters, n_probe=n_probe, **kwargs)
+        return self.index
+
+    def _candidate_rows(self, query, exact=False, n_probe=None):
+        if exact or self.index is None:
+            return None
+        rows = self.index.candidates(query, n_probe)
+        if self.index.size < self._size:
+            rows = np.concatenate([rows, np.arange(self.index.size, self._size)])
+        return rows
+
+    def _search(self, embedding, k, exact=False, n_probe=None):
+        query = _normalize(embedding)
+        rows = self._candidate_rows(query, exact, n_probe)
+        if rows is None:
+            scores = self.matrix @ query
+            best = top_k(scores, k)
+            return best, scores[best]
+        scores = self.matrix[rows] @ query
+        best = top_k(scores, k)
+        return rows[best], scores[best]
+
+    def search_indices(self, embedding, k, exact=False, n_probe=None):
+        """Matrix rows of the `k` documents most similar to `embedding`."""
+        return self._search(embedding, k, exact, n_probe)[0]
+
+    def similarity_search_with_score_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        if not self._size:
+            return []
+        rows, scores = self._search(embedding, k, kwargs.get("exact", False), kwargs.get("n_probe"))
+        # float32 rounding can put a cosine just outside [-1, 1], e.g. 1.00000006
+        scores = np.clip(scores, -1.0, 1.0)
+        return [(self.docs[i], float(score)) for i, score in zip(rows, scores)]
+
+    def similarity_search_by_vector(
+        self, embedding: List[float], k: int = 4, **kwargs: Any
+    ) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return self.similarity_search_by_vector(self.embedding.embed_query(query), k, **kwargs)
+
+    def _select_relevance_score_fn(self):
+        # cosine similarity in [-1, 1] to a relevance score in [0, 1]
+        return lambda score: (score + 1) / 2
+
+    def max_marginal_relevance_search_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        if not self._size:
+            return []
+        candidates, scores = self._search(embedding, fetch_k, kwargs.get("exact", False), kwargs.get("n_probe"))
+        block = self.matrix[candidates]
+        selected = mmr(scores, block @ block.T, k, lambda_mult)
+        return [self.docs[candidates[i]] for i in selected]
+
+    def max_marginal_relevance_search(
+        self,
+        query: str,
+        k: int = 4,
+        fetch_k: int = 20,
+        lambda_mult: float = 0.5,
+        **kwargs: Any,
+    ) -> List[Document]:
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding.embed_query(query), k, fetch_k, lambda_mult, **kwargs
+        )
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding)
+        store.add_texts(texts, metadatas, ids=kwargs.get("ids"))
+        return store
+
+    def save(self, folder):
+        """Writes the embeddings to `embeddings.npy`, the documents to `docs.json`
+        and the IVF index, if any, next to them."""
+        folder = Path(folder)
+        folder.mkdir(parents=True, exist_ok=True)
+        np.save(folder / "embeddings.npy", self.matrix)
+        docs = [{"id": doc.id, "page_content": doc.page_content, "metadata": doc.metadata} for doc in self.docs]
+        (folder / "docs.json").write_text(json.dumps(docs))
+        if self.index is not None:
+            self.index.save(folder)
+
+    @classmethod
+    def load(cls, folder, embedding, mmap=True):
+        """Loads a store written by `save`, memory-mapping the embeddings.
+
+        A memory-mapped store is read-only until documents are added, at which
+        point the embeddings are copied into memory.
+        """
+        folder = Path(folder)
+        store = cls(embedding)
+        store._matrix = np.load(folder / "embeddings.npy", mmap_mode="r" if mmap else None)
+        store._size = len(store._matrix)
+        for doc in json.loads((folder / "docs.json").read_text()):
+            store.docs.append(Document(page_content=doc["page_content"], metadata=doc["metadata"], id=doc["id"]))
+            store.ids.append(doc["id"])
+        store.index = IVFIndex.load(folder, mmap=mmap)
+        return store
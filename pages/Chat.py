@@ -1,17 +1,37 @@
 import utils
-import sqlite3
+import sql_utils
 import streamlit as st
+from streaming import FinalAnswerStreamHandler
 from pathlib import Path
-from sqlalchemy import create_engine
 
 from langchain_community.agent_toolkits import create_sql_agent
 from langchain_community.callbacks import StreamlitCallbackHandler
 from langchain_community.utilities.sql_database import SQLDatabase
 from langchain_core.tools import Tool
-from langchain.memory import ConversationBufferMemory
-import plotly.express as px
+from langchain_community.agent_toolkits.sql.prompt import SQL_PREFIX, SQL_FUNCTIONS_SUFFIX
+from langchain_core.messages import AIMessage
+from langchain_core.prompts import (
+    ChatPromptTemplate,
+    HumanMessagePromptTemplate,
+    MessagesPlaceholder,
+    SystemMessagePromptTemplate,
+)
 import pandas as pd
-from langchain_openai import ChatOpenAI
+from charts import ChartSpec, load_chart_data
+from answer_cache import AnswerCache
+from sql_cache import CachedSQLDatabase, SqlResultCache
+from schema_catalog import SchemaCatalog
+from index_advisor import QueryLog
+from sqlite_pool import create_readonly_engine
+from query_guard import QueryGuard, RejectionTracker
+from chat_memory import BoundedConversationMemory
+from agent_runner import AgentRun, AgentRunner, RunCancelled, current_run
+
+# Handle multi-page structure: page is in pages/, assets is in parent
+SAMPLE_DB_PATH = (Path(__file__).parent.parent / "assets/Chinook.db").absolute()
+
+# Outputs of turns that did not finish normally, e.g. "Agent stopped due to max iterations."
+FAILED_ANSWER_PREFIXES = ("Agent stopped due to", "Error")
 
 # Set page config for the Chat page
 st.set_page_config(page_title="MyThanks Chatbot - Chat", page_icon="🛒", layout="wide")
@@ -134,25 +154,74 @@ class SqlChatbot:
     def __init__(self):
         # We skip calling utils.sync_st_session() as it's causing crashes in this Streamlit version
         # and localize the LLM configuration to keep the sidebar clean.
-        self.llm = ChatOpenAI(
-            model_name="gpt-4o-mini", 
-            temperature=0, 
-            streaming=True, 
-            api_key=st.secrets.get("OPENAI_API_KEY")
+        self.llm = utils.get_llm_registry().get(
+            "openai",
+            model="gpt-4o-mini",
+            api_key=st.secrets.get("OPENAI_API_KEY"),
+            temperature=0,
+            streaming=True
         )
     
-    @st.cache_resource
+    @utils.cache_resource("sql.db")
     def get_db(_self, db_uri):
         if db_uri == 'USE_SAMPLE_DB':
-            # Handle multi-page structure: page is in pages/, assets is in parent
-            db_filepath = (Path(__file__).parent.parent / "assets/Chinook.db").absolute()
-            db_uri = f"sqlite:////{db_filepath}"
-            creator = lambda: sqlite3.connect(f"file:{db_filepath}?mode=ro", uri=True)
-            db = SQLDatabase(create_engine("sqlite:///", creator=creator))
+            db_filepath = SAMPLE_DB_PATH
+            pool_config = st.secrets.get("SQLITE_POOL", {})
+            engine = create_readonly_engine(
+                db_filepath,
+                pool_size=pool_config.get("SIZE", 4),
+                timeout=pool_config.get("TIMEOUT", 30),
+                mmap_size=pool_config.get("MMAP_SIZE", 256 * 1024 * 1024),
+                cache_size=pool_config.get("CACHE_SIZE", -64 * 1024),
+                temp_store=pool_config.get("TEMP_STORE", "MEMORY")
+            )
+            result_cache = SqlResultCache(
+                max_bytes=st.secrets.get("SQL_RESULT_CACHE", {}).get("MAX_BYTES", 64 * 1024 * 1024)
+            )
+            # Workload for index_advisor.py, the app itself never writes to the db
+            log_config = st.secrets.get("QUERY_LOG", {})
+            query_log = None
+            if log_config.get("ENABLED", True):
+                query_log = QueryLog(log_config.get("PATH", ".cache/query_log.jsonl"))
+            # Generated SQL gets a time budget, row caps and a plan cost check
+            guard_config = st.secrets.get("QUERY_GUARD", {})
+            db = CachedSQLDatabase(
+                engine,
+                result_cache=result_cache,
+                version_fn=lambda: sql_utils.db_version(db_filepath),
+                query_log=query_log,
+                query_guard=QueryGuard(
+                    timeout=guard_config.get("TIMEOUT", 10),
+                    max_rows=guard_config.get("MAX_ROWS", 1000),
+                    max_frame_rows=guard_config.get("MAX_FRAME_ROWS", 200_000),
+                    max_plan_rows=guard_config.get("MAX_PLAN_ROWS", 5_000_000)
+                ),
+                lazy_table_reflection=True
+            )
+            db.catalog = SchemaCatalog.load_or_build(db, db_filepath)
         else:
             db = SQLDatabase.from_uri(database_uri=db_uri)
         return db
 
+    @utils.cache_resource("sql.answer_cache")
+    def get_answer_cache(_self):
+        config = st.secrets.get("ANSWER_CACHE", {})
+        return AnswerCache(
+            utils.configure_embedding_model(),
+            max_entries=config.get("MAX_ENTRIES", 256),
+            ttl=config.get("TTL", 3600),
+            similarity_threshold=config.get("SIMILARITY_THRESHOLD", 0.95)
+        )
+
+    @utils.cache_resource("sql.agent_runner")
+    def get_agent_runner(_self):
+        return AgentRunner(max_workers=st.secrets.get("AGENT_RUNNER", {}).get("MAX_WORKERS", 4))
+
+    @utils.cache_resource("sql.figures", max_entries=st.secrets.get("CHARTS", {}).get("FIGURE_CACHE_ENTRIES", 64))
+    def get_figure(_self, digest, _chart):
+        # keyed on the spec digest, so the same chart in any session is built once
+        return _chart.to_figure()
+
     def get_agent(self, db):
         if "sql_agent" not in st.session_state:
             # Define visualization tool
@@ -171,22 +240,35 @@ class SqlChatbot:
                     chart_type = chart_type.strip().lower()
                     query = query.strip()
 
-                    df = pd.read_sql(query, db._engine)
+                    if isinstance(db, CachedSQLDatabase):
+                        read_frame = db.read_frame
+                    else:
+                        read_frame = lambda sql: pd.read_sql(sql, db._engine)
+                    # Reuses the cached result of the query, falls back to SQL aggregation if it is truncated
+                    config = st.secrets.get("CHARTS", {})
+                    df, total_rows = load_chart_data(
+                        chart_type,
+                        query,
+                        read_frame,
+                        max_points=config.get("MAX_POINTS", 2000),
+                        max_fetch=config.get("MAX_FETCH_ROWS", 100_000),
+                        max_slices=config.get("MAX_PIE_SLICES", 10)
+                    )
                     if df.empty:
                         return "No data found for visualization."
-                    
-                    x_col = df.columns[0]
-                    y_col = df.columns[1] if len(df.columns) > 1 else None
-                    
-                    if chart_type == "pie":
-                        fig = px.pie(df, names=x_col, values=y_col if y_col else None, title="Data Distribution")
-                    elif chart_type == "line":
-                        fig = px.line(df, x=x_col, y=y_col, title="Trend Analysis")
-                    else: # Default to bar
-                        fig = px.bar(df, x=x_col, y=y_col, title="Comparison Chart")
-                    
-                    st.session_state["cur_fig"] = fig
-                    st.plotly_chart(fig, use_container_width=True)
+
+                    # Keep a compact spec in the transcript, figures are rebuilt on demand
+                    chart = ChartSpec(chart_type, df, max_rows=config.get("MAX_ROWS", 5000), total_rows=total_rows)
+
+                    run = current_run()
+                    if run is not None:
+                        # running on a worker thread, the UI renders it when the run finishes
+                        run.charts.append(chart)
+                    else:
+                        st.session_state["cur_chart"] = chart
+                        st.plotly_chart(self.get_figure(chart.digest, chart), use_container_width=True)
+                    if chart.truncated:
+                        return f"Successfully rendered a {chart_type} chart of {len(df)} points summarizing {total_rows} rows."
                     return f"Successfully rendered a {chart_type} chart."
                 except Exception as e:
                     return f"Error: {str(e)}"
@@ -197,17 +279,35 @@ class SqlChatbot:
                 description="Use this to create charts. Input: 'chart_type|sql_query'. Types: bar, pie, line. Example: 'pie|SELECT Genre, Count(*) FROM Tracks GROUP BY Genre'"
             )
 
-            memory = ConversationBufferMemory(memory_key="chat_history", return_messages=True)
+            memory_config = st.secrets.get("MEMORY", {})
+            memory = BoundedConversationMemory(
+                llm=self.llm,
+                memory_key="chat_history",
+                return_messages=True,
+                max_token_limit=memory_config.get("MAX_TOKENS", 2000),
+                keep_last=memory_config.get("KEEP_LAST", 2)
+            )
+            # Same as the default openai-tools prompt, plus the conversation so far
+            prompt = ChatPromptTemplate.from_messages([
+                SystemMessagePromptTemplate.from_template(SQL_PREFIX),
+                MessagesPlaceholder(variable_name="chat_history", optional=True),
+                HumanMessagePromptTemplate.from_template("{input}"),
+                AIMessage(content=SQL_FUNCTIONS_SUFFIX),
+                MessagesPlaceholder(variable_name="agent_scratchpad"),
+            ])
             st.session_state.sql_agent = create_sql_agent(
                 llm=self.llm,
                 db=db,
+                prompt=prompt,
                 extra_tools=[visualize_tool],
                 top_k=10,
                 verbose=False,
                 agent_type="openai-tools",
                 handle_parsing_errors=True,
                 handle_sql_errors=True,
-                memory=memory
+                # memory has to sit on the AgentExecutor, create_sql_agent's own
+                # `memory` argument ends up on the inner agent and is never used
+                agent_executor_kwargs={"memory": memory}
             )
         return st.session_state.sql_agent
 
@@ -229,7 +329,8 @@ class SqlChatbot:
             st.session_state["current_page"] = current_page
         if st.session_state["current_page"] != current_page:
             try:
-                st.cache_resource.clear()
+                utils.clear_session_resources()
+                st.session_state.pop("history_shown", None)
                 del st.session_state["current_page"]
                 del st.session_state["messages"]
             except:
@@ -239,11 +340,14 @@ class SqlChatbot:
         if "messages" not in st.session_state:
             st.session_state["messages"] = [{"role": "assistant", "content": "Please ask me anything about MyThanks!"}]
         
-        for msg in st.session_state["messages"]:
-            with st.chat_message(msg["role"]):
-                st.write(msg["content"])
-                if "fig" in msg:
-                    st.plotly_chart(msg["fig"], use_container_width=True)
+        messages = st.session_state["messages"]
+        last_chart = next((i for i in reversed(range(len(messages))) if "chart" in messages[i]), None)
+
+        def render_chart(i, msg):
+            # Only the latest chart is sent on every rerun, older ones on request
+            if "chart" in msg and (i == last_chart or st.toggle("Show chart", key=f"show_chart_{i}")):
+                st.plotly_chart(self.get_figure(msg["chart"].digest, msg["chart"]), use_container_width=True)
+        utils.render_chat_history(messages, render_chart)
 
     def main(self):
         self.display_chat_ui()
@@ -283,30 +387,113 @@ class SqlChatbot:
             user_query = selected_suggestion
 
         if user_query:
+            # a newer question supersedes the one still running
+            if "agent_run" in st.session_state:
+                st.session_state.pop("agent_run").cancel()
+
             st.session_state.messages.append({"role": "user", "content": user_query})
             st.chat_message("user").write(user_query)
 
+            # Answers to follow-ups depend on the conversation, so only first turns are shared
+            memory = agent.memory
+            st.session_state["turn_standalone"] = memory is None or not (
+                memory.chat_memory.messages or memory.moving_summary_buffer
+            )
+            cached = None
+            if st.session_state["turn_standalone"]:
+                db_version = sql_utils.db_version(SAMPLE_DB_PATH)
+                cached = self.get_answer_cache().get(user_query, db_version)
+            if cached is not None:
+                with st.chat_message("assistant"):
+                    msg = {"role": "assistant", **cached}
+                    st.session_state.messages.append(msg)
+                    st.markdown(utils.message_markdown(msg["content"]))
+                    if "chart" in msg:
+                        st.plotly_chart(self.get_figure(msg["chart"].digest, msg["chart"]), use_container_width=True)
+                    # keep the agent's memory in step with the transcript
+                    if memory is not None:
+                        memory.save_context({"input": user_query}, {"output": msg["content"]})
+                    utils.print_qa(SqlChatbot, user_query, msg["content"])
+                return
+
+            stream_answer = st.secrets.get("GENERAL", {}).get("STREAM_ANSWER", True)
+            is_dev_mode = st.secrets.get("GENERAL", {}).get("DEV_MODE", False)
+            # answers that only got this far because a query was refused are not cached
+            rejections = st.session_state["turn_rejections"] = RejectionTracker()
+            if is_dev_mode:
+                # Intermediate steps are rendered by Streamlit, so run on the script thread
+                with st.chat_message("assistant"):
+                    callbacks = [StreamlitCallbackHandler(st.container()), rejections]
+                    answer_container = st.empty()
+                    if stream_answer:
+                        callbacks.append(FinalAnswerStreamHandler(answer_container))
+                    result = agent.invoke(
+                        {"input": user_query},
+                        {"callbacks": callbacks}
+                    )
+                    msg = self.finish_turn(user_query, result["output"], st.session_state.pop("cur_chart", None))
+                    answer_container.markdown(utils.message_markdown(msg["content"]))
+                return
+
+            run = AgentRun(user_query)
+            callbacks = [rejections, FinalAnswerStreamHandler(run)] if stream_answer else [rejections]
+            self.get_agent_runner().start(run, agent, {"input": user_query}, callbacks=callbacks)
+            st.session_state["agent_run"] = run
+
+        if "agent_run" in st.session_state:
+            self.poll_agent_run()
+
+    @st.fragment(run_every=0.25)
+    def poll_agent_run(self):
+        """Shows the progress of the session's agent run until it finishes."""
+        run = st.session_state.get("agent_run")
+        if run is None:
+            return
+        if not run.done():
             with st.chat_message("assistant"):
-                # Only show intermediate steps in Dev Mode
-                is_dev_mode = st.secrets.get("GENERAL", {}).get("DEV_MODE", False)
-                callbacks = []
-                if is_dev_mode:
-                    st_cb = StreamlitCallbackHandler(st.container())
-                    callbacks.append(st_cb)
-                
-                result = agent.invoke(
-                    {"input": user_query},
-                    {"callbacks": callbacks}
-                )
-                response = result["output"]
-                
-                msg = {"role": "assistant", "content": response}
-                if "cur_fig" in st.session_state:
-                    msg["fig"] = st.session_state.pop("cur_fig")
-                
-                st.session_state.messages.append(msg)
-                st.write(response)
-                utils.print_qa(SqlChatbot, user_query, response)
+                st.markdown(run.text or "Thinking...")
+            return
+
+        st.session_state.pop("agent_run")
+        try:
+            result = run.result()
+        except RunCancelled:
+            return
+        except Exception:
+            utils.logger.exception(f"Agent run failed for query: {run.query}")
+            # answer the question anyway, nothing about a failed turn is cached
+            st.session_state.pop("turn_standalone", None)
+            st.session_state.pop("turn_rejections", None)
+            st.session_state.messages.append({
+                "role": "assistant",
+                "content": "Sorry, something went wrong while answering your question. Please try again."
+            })
+            st.rerun()
+        self.finish_turn(run.query, result["output"], run.charts[-1] if run.charts else None)
+        # render the finished turn as part of the history and stop polling
+        st.rerun()
+
+    def finish_turn(self, user_query, response, chart=None):
+        """Records a finished agent turn in the transcript and the answer cache."""
+        msg = {"role": "assistant", "content": response}
+        if chart is not None:
+            msg["chart"] = chart
+        st.session_state.messages.append(msg)
+        utils.print_qa(SqlChatbot, user_query, response)
+
+        # a failed turn would otherwise be served to every session for the whole TTL
+        rejections = st.session_state.pop("turn_rejections", None)
+        failed = response.startswith(FAILED_ANSWER_PREFIXES) or (rejections is not None and rejections.rejected)
+        if st.session_state.pop("turn_standalone", False) and not failed:
+            db_version = sql_utils.db_version(SAMPLE_DB_PATH)
+            self.get_answer_cache().put(user_query, db_version, {k: v for k, v in msg.items() if k != "role"})
+
+        # a growing mean wait means SQLITE_POOL.SIZE is too small for the traffic
+        wait_stats = getattr(self.get_db('USE_SAMPLE_DB')._engine.pool, "wait_stats", None)
+        if wait_stats is not None:
+            utils.logger.info(f"SQLite pool wait stats: {wait_stats.snapshot()}")
+        utils.logger.info(f"LLM client pool stats: {utils.get_llm_registry().pool_stats()}")
+        return msg
 
 
 if __name__ == "__main__":
@@ -0,0 +1,55 @@
+# PDF parsing that runs inside the ingestion process pool. Parse workers import
+# this module to unpickle their tasks, so it only depends on pypdf and
+# langchain_core: importing the app modules (streamlit, langchain, fastembed)
+# would cost every worker seconds of startup.
+import time
+from io import BytesIO
+from multiprocessing import shared_memory
+
+from pypdf import PdfReader
+from langchain_core.documents import Document
+
+
+def read_page(reader, name, page_num):
+    """Extracts one page, with the same metadata as `PyPDFLoader` and the file name as source."""
+    return Document(
+        page_content=reader.pages[page_num].extract_text(),
+        metadata={"source": name, "page": page_num}
+    )
+
+
+def iter_pdf_bytes(name, data, start=0, stop=None):
+    """Yields the pages of an in-memory PDF one at a time.
+
+    Args:
+        name (str): file name recorded as the document source
+        data (bytes): content of the PDF file
+        start (int): first page to yield
+        stop (int): page to stop before, defaults to the last page
+    """
+    reader = PdfReader(BytesIO(data))
+    stop = len(reader.pages) if stop is None else stop
+    for page_num in range(start, stop):
+        yield read_page(reader, name, page_num)
+
+
+# the last shared file a worker opened, so its tasks on that file share one reader
+_worker_file = None
+
+
+def parse_shared_range(name, shm_name, size, start, stop):
+    """Parses pages `start` to `stop` of a PDF held in a shared memory block.
+
+    Runs in the parse workers, returns the pages and the seconds spent.
+    """
+    global _worker_file
+    begin = time.perf_counter()
+    if _worker_file is None or _worker_file[0] != shm_name:
+        shm = shared_memory.SharedMemory(name=shm_name)
+        try:
+            data = bytes(shm.buf[:size])
+        finally:
+            shm.close()
+        _worker_file = (shm_name, PdfReader(BytesIO(data)))
+    docs = [read_page(_worker_file[1], name, page_num) for page_num in range(start, stop)]
+    return docs, time.perf_counter() - begin
@@ -0,0 +1,170 @@
+import re
+import json
+import time
+import threading
+from math import prod
+from contextlib import contextmanager
+from collections import defaultdict
+
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from langchain_core.callbacks import BaseCallbackHandler
+
+from sql_utils import quote_identifier, table_aliases
+
+
+class QueryRejected(SQLAlchemyError):
+    """A generated query was stopped or refused by the QueryGuard.
+
+    Subclasses SQLAlchemyError, so the agent's SQL tools return it as an
+    "Error: ..." observation. The message is JSON, giving the agent the
+    reason and a hint for a cheaper retry.
+    """
+
+    def __init__(self, reason, message, hint):
+        self.reason = reason
+        self.hint = hint
+        super().__init__(json.dumps({"error": reason, "message": message, "hint": hint}))
+
+    @staticmethod
+    def found_in(text):
+        """Whether a tool output carries a QueryRejected error."""
+        return _REJECTION.search(text) is not None
+
+
+# the start of a QueryRejected message, json.dumps keeps the key order
+_REJECTION = re.compile(r'\{"error": "\w+", "message": ')
+
+
+class RejectionTracker(BaseCallbackHandler):
+    """Notes whether any tool in an agent run returned a QueryRejected error."""
+
+    def __init__(self):
+        self.rejected = False
+
+    def on_tool_end(self, output, **kwargs):
+        if QueryRejected.found_in(str(getattr(output, "content", output))):
+            self.rejected = True
+
+
+class QueryGuard:
+    """Limits the cost of LLM-generated queries against a SQLite database.
+
+    Before a query runs, its `EXPLAIN QUERY PLAN` is costed: full table scans
+    joined in the same loop multiply their row counts, and a query estimated
+    to visit more than `max_plan_rows` rows is rejected. While it runs, a
+    progress handler interrupts it after `timeout` seconds. Callers enforce
+    row caps by fetching at most `max_rows` rows (`max_frame_rows` for chart
+    data).
+
+    Args:
+        timeout (float): wall-clock seconds a query may run
+        max_rows (int): rows returned to the agent's SQL tools
+        max_frame_rows (int): rows returned for chart data
+        max_plan_rows (int): estimated rows visited above which a query is rejected
+        check_every (int): SQLite VM instructions between deadline checks
+    """
+
+    def __init__(self, timeout=10, max_rows=1000, max_frame_rows=200_000, max_plan_rows=5_000_000,
+                 check_every=10_000):
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.max_frame_rows = max_frame_rows
+        self.max_plan_rows = max_plan_rows
+        self.check_every = check_every
+        self._row_counts = None
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Forgets the table sizes, called when the database changes."""
+        with self._lock:
+            self._row_counts = None
+
+    def row_counts(self, connection):
+        """Approximate rows per table, MAX(rowid) is used as it needs no scan."""
+        with self._lock:
+            if self._row_counts is not None:
+                return self._row_counts
+        counts = {}
+        tables = connection.exec_driver_sql(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%'"
+        ).fetchall()
+        for (table,) in tables:
+            try:
+                count = connection.exec_driver_sql(f"SELECT MAX(rowid) FROM {quote_identifier(table)}").scalar()
+            except SQLAlchemyError:
+                # WITHOUT ROWID tables
+                count = connection.exec_driver_sql(f"SELECT COUNT(*) FROM {quote_identifier(table)}").scalar()
+            counts[table] = count or 0
+        with self._lock:
+            self._row_counts = counts
+        return counts
+
+    def estimate_rows(self, connection, query):
+        """Rows the query plan is expected to visit.
+
+        Plan entries under the same parent are nested loops: a scan of a
+        table, or of all of one of its indexes, costs the table's row count,
+        an index search is counted as one row per outer row. Scans of
+        subqueries and CTEs are not costed.
+        """
+        counts = self.row_counts(connection)
+        aliases = table_aliases(query, counts)
+        loops = defaultdict(list)
+        for _, parent, _, detail in connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {query}"):
+            words = detail.split()
+            if len(words) < 2 or words[0] not in ("SCAN", "SEARCH"):
+                continue
+            name = words[2] if words[1] == "TABLE" else words[1]
+            if " AS " in detail:
+                name = words[words.index("AS") + 1]
+            table = aliases.get(name.lower())
+            if words[0] == "SCAN" and table is not None:
+                loops[parent].append(counts.get(table, 0))
+            else:
+                loops[parent].append(1)
+        return sum(prod(factors) for factors in loops.values() if factors)
+
+    def truncation_notice(self):
+        """JSON notice for a result cut at `max_rows`, in the same shape as QueryRejected."""
+        return json.dumps({
+            "warning": "too_many_rows",
+            "message": f"Only the first {self.max_rows:,} rows are shown, the query returns more.",
+            "hint": "Do not count or total these rows: aggregate in SQL (COUNT, SUM, GROUP BY) "
+                    "or add a LIMIT, then retry."
+        })
+
+    def check_plan(self, connection, query):
+        """Raises QueryRejected if the plan is expected to visit too many rows."""
+        try:
+            estimate = self.estimate_rows(connection, query)
+        except SQLAlchemyError:
+            # not explainable, e.g. a syntax error, running it reports the real error
+            return
+        if estimate > self.max_plan_rows:
+            raise QueryRejected(
+                "query_too_expensive",
+                f"The query plan would visit about {estimate:,} rows, the limit is {self.max_plan_rows:,}.",
+                "Join tables on their key columns, filter with WHERE and aggregate in SQL, then retry."
+            )
+
+    @contextmanager
+    def time_limit(self, connection):
+        """Interrupts statements run (and rows fetched) inside the block after `timeout` seconds."""
+        dbapi_connection = connection.connection.dbapi_connection
+        if not hasattr(dbapi_connection, "set_progress_handler"):
+            yield
+            return
+        deadline = time.monotonic() + self.timeout
+        dbapi_connection.set_progress_handler(lambda: time.monotonic() > deadline, self.check_every)
+        try:
+            yield
+        except OperationalError as e:
+            if "interrupted" in str(e.orig) and time.monotonic() > deadline:
+                raise QueryRejected(
+                    "query_timeout",
+                    f"The query was stopped after {self.timeout}s.",
+                    "Simplify the query: fewer joins, filters on indexed columns, or a LIMIT, then retry."
+                ) from e
+            raise
+        finally:
+            dbapi_connection.set_progress_handler(None, 0)
@@ -0,0 +1,155 @@
+import time
+import inspect
+import threading
+from collections import OrderedDict, defaultdict
+
+GLOBAL = "global"
+SESSION = "session"
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, set):
+        return frozenset(_freeze(v) for v in value)
+    return value
+
+
+def call_key(func, args, kwargs):
+    """Cache key for a call, skipping arguments whose name starts with "_".
+
+    This follows `st.cache_resource`, so `_self` and unhashable arguments
+    can be excluded the same way.
+    """
+    bound = inspect.signature(func).bind(*args, **kwargs)
+    bound.apply_defaults()
+    return tuple(
+        (name, _freeze(value)) for name, value in bound.arguments.items()
+        if not name.startswith("_")
+    )
+
+
+class ResourceCache:
+    """Namespaced cache for process-wide and per-session resources.
+
+    Global resources (models, engines, shared indexes) live until their
+    namespace is invalidated, unless the caller gives them a `ttl` or caps
+    their namespace with `max_entries`. Session resources live in a scope
+    per browser session, so one session can drop its own resources without
+    affecting anyone else. Each session keeps at most `max_session_entries`
+    resources and at most `max_sessions` sessions are kept, least recently
+    used first out. Hits, misses, evictions and invalidations are counted
+    per namespace.
+
+    Args:
+        max_sessions (int): maximum number of session scopes kept
+        max_session_entries (int): maximum number of resources per session
+    """
+
+    def __init__(self, max_sessions=256, max_session_entries=32):
+        self.max_sessions = max_sessions
+        self.max_session_entries = max_session_entries
+        self._global = OrderedDict()
+        self._sessions = OrderedDict()
+        self._creating = {}
+        self._stats = defaultdict(lambda: {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0})
+        self._lock = threading.Lock()
+
+    def _scope(self, session_id):
+        if session_id is None:
+            return self._global
+        scope = self._sessions.get(session_id)
+        if scope is None:
+            scope = self._sessions[session_id] = OrderedDict()
+            while len(self._sessions) > self.max_sessions:
+                _, evicted = self._sessions.popitem(last=False)
+                for namespace, _ in evicted:
+                    self._stats[namespace]["evictions"] += 1
+        self._sessions.move_to_end(session_id)
+        return scope
+
+    def _lookup(self, scope, entry_key):
+        # scope values are (resource, expiry) pairs, the caller holds the lock
+        entry = scope.get(entry_key)
+        if entry is None:
+            return None
+        if entry[1] is not None and time.monotonic() >= entry[1]:
+            del scope[entry_key]
+            self._stats[entry_key[0]]["evictions"] += 1
+            return None
+        self._stats[entry_key[0]]["hits"] += 1
+        scope.move_to_end(entry_key)
+        return entry
+
+    def get(self, namespace, key, factory, session_id=None, max_entries=None, ttl=None):
+        """Returns the cached resource, creating it with `factory` on a miss.
+
+        Args:
+            namespace (str): group the resource is counted and invalidated under
+            key (hashable): identifies the resource within its namespace
+            factory (callable): builds the resource, called without arguments
+            session_id (str): session scope, None for a global resource
+            max_entries (int): maximum number of resources kept for the
+                namespace in the scope, least recently used first out
+            ttl (float): seconds the resource is kept after it is created
+        """
+        entry_key = (namespace, key)
+        scope_key = (session_id, entry_key)
+        with self._lock:
+            entry = self._lookup(self._scope(session_id), entry_key)
+            if entry is not None:
+                return entry[0]
+            creating = self._creating.setdefault(scope_key, threading.Lock())
+
+        # Build outside the main lock, but only once per key
+        with creating:
+            with self._lock:
+                entry = self._lookup(self._scope(session_id), entry_key)
+                if entry is not None:
+                    return entry[0]
+                self._stats[namespace]["misses"] += 1
+            try:
+                value = factory()
+            except BaseException:
+                with self._lock:
+                    self._creating.pop(scope_key, None)
+                raise
+            with self._lock:
+                scope = self._scope(session_id)
+                scope[entry_key] = (value, None if ttl is None else time.monotonic() + ttl)
+                # the value is visible now, so waiters and new callers find it
+                self._creating.pop(scope_key, None)
+                if max_entries is not None:
+                    keys = [k for k in scope if k[0] == namespace]
+                    for evicted in keys[:max(len(keys) - max_entries, 0)]:
+                        del scope[evicted]
+                        self._stats[namespace]["evictions"] += 1
+                if session_id is not None:
+                    while len(scope) > self.max_session_entries:
+                        (evicted_namespace, _), _ = scope.popitem(last=False)
+                        self._stats[evicted_namespace]["evictions"] += 1
+            return value
+
+    def invalidate(self, namespace=None, session_id=None):
+        """Drops cached resources, returns how many were dropped.
+
+        With a `session_id`, only that session's resources are dropped;
+        otherwise only global ones. With a `namespace`, only resources in
+        that namespace are dropped.
+        """
+        with self._lock:
+            scope = self._global if session_id is None else self._sessions.get(session_id, {})
+            keys = [k for k in scope if namespace is None or k[0] == namespace]
+            for key in keys:
+                del scope[key]
+                self._stats[key[0]]["invalidations"] += 1
+            if session_id is not None and not scope:
+                self._sessions.pop(session_id, None)
+            return len(keys)
+
+    def stats(self):
+        """Returns hit, miss, eviction and invalidation counts per namespace."""
+        with self._lock:
+            return {namespace: dict(counts) for namespace, counts in self._stats.items()}
@@ -0,0 +1,103 @@
+import json
+import sqlite3
+from pathlib import Path
+
+from langchain_community.utilities.sql_database import SQLDatabase
+
+import sql_utils
+from utils import logger
+
+
+class SchemaCatalog:
+    """Schema description of a SQLite database, built once and kept in memory.
+
+    Holds, per table, the prompt text normally produced by
+    `SQLDatabase.get_table_info` (DDL plus sample rows), the row count, the
+    number of distinct values per column and the outgoing foreign keys. The
+    catalog is persisted as JSON next to the database file and reused on the
+    next start as long as the database version has not changed.
+    """
+
+    def __init__(self, db_filepath, version, tables):
+        self.db_filepath = Path(db_filepath)
+        self.version = version
+        self.tables = tables
+
+    @staticmethod
+    def path_for(db_filepath):
+        return Path(f"{db_filepath}.catalog.json")
+
+    @classmethod
+    def build(cls, db, db_filepath):
+        """Reflects every usable table of `db` and collects its statistics.
+
+        Args:
+            db (SQLDatabase): database used to render the table info text
+            db_filepath (str | Path): path to the SQLite file behind `db`
+        """
+        version = sql_utils.db_version(db_filepath)
+        tables = {}
+        conn = sqlite3.connect(f"file:{db_filepath}?mode=ro", uri=True)
+        try:
+            for name in db.get_usable_table_names():
+                # bypass any catalog-backed override on `db`
+                info = SQLDatabase.get_table_info(db, [name])
+                columns = [row[1] for row in conn.execute(f"PRAGMA table_info({sql_utils.quote_identifier(name)})")]
+                counts = ", ".join(f"COUNT(DISTINCT {sql_utils.quote_identifier(c)})" for c in columns)
+                row = conn.execute(f"SELECT COUNT(*), {counts} FROM {sql_utils.quote_identifier(name)}").fetchone()
+                foreign_keys = [
+                    {"column": fk[3], "ref_table": fk[2], "ref_column": fk[4]}
+                    for fk in conn.execute(f"PRAGMA foreign_key_list({sql_utils.quote_identifier(name)})")
+                ]
+                tables[name] = {
+                    "info": info,
+                    "row_count": row[0],
+                    "cardinalities": dict(zip(columns, row[1:])),
+                    "foreign_keys": foreign_keys,
+                }
+        finally:
+            conn.close()
+        return cls(db_filepath, version, tables)
+
+    @classmethod
+    def load(cls, db_filepath):
+        """Returns the persisted catalog, or None if missing or out of date."""
+        path = cls.path_for(db_filepath)
+        try:
+            data = json.loads(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if data.get("version") != sql_utils.db_version(db_filepath):
+            return None
+        return cls(db_filepath, data["version"], data["tables"])
+
+    def save(self):
+        path = self.path_for(self.db_filepath)
+        try:
+            path.write_text(json.dumps({"version": self.version, "tables": self.tables}))
+        except OSError as e:
+            logger.warning(f"Could not persist schema catalog to {path}: {e}")
+
+    @classmethod
+    def load_or_build(cls, db, db_filepath):
+        catalog = cls.load(db_filepath)
+        if catalog is None:
+            catalog = cls.build(db, db_filepath)
+            catalog.save()
+        return catalog
+
+    def table_info(self, table_names=None):
+        """Same output as `SQLDatabase.get_table_info`, served from memory."""
+        if table_names is None:
+            table_names = list(self.tables)
+        missing_tables = set(table_names).difference(self.tables)
+        if missing_tables:
+            raise ValueError(f"table_names {missing_tables} not found in database")
+        return "\n\n".join(sorted(self.tables[name]["info"] for name in set(table_names)))
+
+    def foreign_key_graph(self):
+        """Maps each table to the tables its foreign keys reference."""
+        return {
+            name: sorted({fk["ref_table"] for fk in table["foreign_keys"]})
+            for name, table in self.tables.items()
+        }
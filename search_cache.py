@@ -0,0 +1,69 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+def normalize_query(query):
+    return re.sub(r"\s+", " ", query.strip().lower())
+
+
+class SearchCache:
+    """Caches the results of a search function for all sessions.
+
+    Results expire after `ttl` seconds and the oldest are evicted beyond
+    `max_entries`. Identical searches issued while one is already in flight
+    wait for that search instead of starting their own.
+
+    Args:
+        search (callable): function taking a query string and returning a result
+        ttl (int): seconds a result stays valid
+        max_entries (int): maximum number of cached results
+    """
+
+    def __init__(self, search, ttl=900, max_entries=1024):
+        self.search = search
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+
+    def run(self, query):
+        key = normalize_query(query)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            future = self._in_flight.get(key)
+            leader = future is None
+            if leader:
+                self.misses += 1
+                future = self._in_flight[key] = Future()
+            else:
+                self.hits += 1
+
+        if not leader:
+            return future.result()
+
+        try:
+            result = self.search(query)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            with self._lock:
+                self._entries[key] = (time.monotonic() + self.ttl, result)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+            return result
+        finally:
+            with self._lock:
+                del self._in_flight[key]
@@ -0,0 +1,207 @@
+import sys
+import time
+import threading
+from contextlib import nullcontext
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+from langchain_community.utilities.sql_database import SQLDatabase
+
+import sql_utils
+from schema_catalog import SchemaCatalog
+
+
+class ColumnarResult:
+    """Query result stored column by column.
+
+    Columns holding only ints or only floats are packed into NumPy arrays,
+    everything else is kept as a tuple of Python values. `truncated` is set
+    when the query returned more rows than were fetched.
+    """
+
+    def __init__(self, columns, rows, truncated=False):
+        self.columns = tuple(columns)
+        self.num_rows = len(rows)
+        self.truncated = truncated
+        self.data = tuple(self._pack([row[i] for row in rows]) for i in range(len(self.columns)))
+        self.nbytes = sum(self._sizeof(col) for col in self.data)
+
+    @staticmethod
+    def _pack(values):
+        if values and all(type(v) is int for v in values):
+            try:
+                return np.array(values, dtype=np.int64)
+            except OverflowError:
+                return tuple(values)
+        if values and all(type(v) is float for v in values):
+            return np.array(values, dtype=np.float64)
+        return tuple(values)
+
+    @staticmethod
+    def _sizeof(col):
+        if isinstance(col, np.ndarray):
+            return col.nbytes
+        return sys.getsizeof(col) + sum(sys.getsizeof(v) for v in col)
+
+    def _columns_as_lists(self, limit=None):
+        return [col[:limit].tolist() if isinstance(col, np.ndarray) else list(col[:limit]) for col in self.data]
+
+    def to_dicts(self, limit=None):
+        """Rows in the shape returned by `SQLDatabase._execute`."""
+        return [dict(zip(self.columns, row)) for row in zip(*self._columns_as_lists(limit))]
+
+    def to_frame(self, limit=None):
+        num_rows = self.num_rows if limit is None else min(limit, self.num_rows)
+        df = pd.DataFrame({i: col[:num_rows] for i, col in enumerate(self.data)}, index=range(num_rows))
+        df.columns = list(self.columns)
+        return df
+
+
+class SqlResultCache:
+    """Process-wide cache of query results with a total byte-size budget.
+
+    Results are keyed on the normalized SQL text and the database version,
+    and evicted least-recently-used once `max_bytes` is exceeded.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, query, version):
+        key = (version, sql_utils.normalize_sql(query))
+        with self._lock:
+            result = self._entries.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, query, version, result):
+        if result.nbytes > self.max_bytes:
+            return
+        key = (version, sql_utils.normalize_sql(query))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[key] = result
+            self.nbytes += result.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+class CachedSQLDatabase(SQLDatabase):
+    """SQLDatabase that serves repeated queries from a `SqlResultCache`.
+
+    Both the agent's SQL tools and `read_frame` go through the same cache, so
+    a query run by `sql_db_query` is not executed again to draw a chart. Once
+    `catalog` is set, table info for the schema tools is served from it. With
+    a `query_log`, every query is recorded for the index advisor. With a
+    `query_guard`, queries are costed before they run, stopped after its
+    timeout and their results capped at its row limits. Pooled
+    connections are disposed of when the version changes, so connections
+    opened with `immutable=1` pick up a replaced database file.
+    """
+
+    def __init__(self, engine, result_cache, version_fn, query_log=None, query_guard=None, **kwargs):
+        super().__init__(engine, **kwargs)
+        self.result_cache = result_cache
+        self.version_fn = version_fn
+        self.query_log = query_log
+        self.query_guard = query_guard
+        self.catalog = None
+        self._engine_version = None
+        # whether the last `_execute` on this thread cut its result short
+        self._local = threading.local()
+
+    def get_table_info(self, table_names=None):
+        if self.catalog is None:
+            return super().get_table_info(table_names)
+        if self.catalog.version != self.version_fn():
+            self.catalog = SchemaCatalog.load_or_build(self, self.catalog.db_filepath)
+        return self.catalog.table_info(table_names)
+
+    def _query_result(self, query, max_rows=None):
+        version = self.version_fn()
+        if version != self._engine_version:
+            if self._engine_version is not None:
+                self._engine.dispose()
+                if self.query_guard is not None:
+                    self.query_guard.reset()
+            self._engine_version = version
+        result = self.result_cache.get(query, version)
+        # a truncated result only serves callers that want no more rows than it has
+        if result is not None and (not result.truncated or (max_rows is not None and max_rows <= result.num_rows)):
+            if self.query_log is not None:
+                self.query_log.record(query, 0.0, cached=True)
+            return result
+
+        guard = self.query_guard
+        start = time.perf_counter()
+        with self._engine.connect() as connection:
+            if guard is not None:
+                guard.check_plan(connection, query)
+            with guard.time_limit(connection) if guard is not None else nullcontext():
+                cursor = connection.exec_driver_sql(query)
+                if not cursor.returns_rows:
+                    return None
+                if max_rows is None:
+                    rows, truncated = cursor.fetchall(), False
+                else:
+                    # SQLite produces rows lazily, so a capped fetch also caps the work
+                    rows = cursor.fetchmany(max_rows + 1)
+                    truncated = len(rows) > max_rows
+                    rows = rows[:max_rows]
+            result = ColumnarResult(cursor.keys(), rows, truncated=truncated)
+        if self.query_log is not None:
+            self.query_log.record(query, time.perf_counter() - start)
+        self.result_cache.put(query, version, result)
+        return result
+
+    def _execute(self, command, fetch="all", *, parameters=None, execution_options=None):
+        if not isinstance(command, str) or parameters or execution_options or fetch not in ("all", "one"):
+            return super()._execute(command, fetch, parameters=parameters, execution_options=execution_options)
+        max_rows = self.query_guard.max_rows if self.query_guard is not None else None
+        result = self._query_result(command, max_rows)
+        if result is None:
+            return []
+        self._local.truncated = fetch == "all" and result.truncated
+        return result.to_dicts(1 if fetch == "one" else max_rows)
+
+    def run(self, command, fetch="all", include_columns=False, **kwargs):
+        """Same as `SQLDatabase.run`, with a notice appended when the rows were
+        cut at the guard's row cap, so the agent does not count or total a
+        partial result."""
+        self._local.truncated = False
+        output = super().run(command, fetch, include_columns, **kwargs)
+        if self._local.truncated and isinstance(output, str):
+            output += "\n" + self.query_guard.truncation_notice()
+        return output
+
+    def read_frame(self, query):
+        """Runs a query through the result cache and returns a DataFrame.
+
+        At most `max_frame_rows` rows are returned, `df.attrs["truncated"]`
+        tells whether the query had more.
+        """
+        max_rows = self.query_guard.max_frame_rows if self.query_guard is not None else None
+        result = self._query_result(query, max_rows)
+        if result is None:
+            return pd.DataFrame()
+        df = result.to_frame(max_rows)
+        df.attrs["truncated"] = result.truncated
+        return df
@@ -0,0 +1,98 @@
+import os
+import re
+import sqlite3
+from functools import lru_cache
+
+
+@lru_cache(maxsize=32)
+def _schema_version(db_filepath, mtime_ns, size):
+    conn = sqlite3.connect(f"file:{db_filepath}?mode=ro", uri=True)
+    try:
+        return conn.execute("PRAGMA schema_version").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def db_version(db_filepath):
+    """Returns a version string for a SQLite database file.
+
+    The version changes whenever the file is rewritten or its schema changes,
+    so it can be used as part of a cache key for anything derived from the db.
+
+    Args:
+        db_filepath (str | Path): path to the SQLite database file
+    """
+    stat = os.stat(db_filepath)
+    schema_version = _schema_version(str(db_filepath), stat.st_mtime_ns, stat.st_size)
+    return f"{stat.st_mtime_ns}-{stat.st_size}-{schema_version}"
+
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+
+def unquote_identifier(name):
+    if name[:1] in "\"[`":
+        return name[1:-1]
+    return name
+
+
+# literals, quoted identifiers and block comments | line comments | whitespace
+_SQL_TOKEN = re.compile(
+    r"""('(?:[^']|'')*'|"(?:[^"]|"")*"|\[[^\]]*\]|`[^`]*`|/\*[\s\S]*?(?:\*/|$))|(--[^\n]*)\s*|(\s+)"""
+)
+
+
+def normalize_sql(query):
+    """Collapses whitespace and trailing semicolons in a SQL query.
+
+    Quoted literals, identifiers and comments are left untouched, and a line
+    comment keeps the newline that ends it, so two queries that normalize to
+    the same text always return the same rows. The result may end in a line
+    comment, so put a newline after it before appending more SQL.
+
+    Args:
+        query (str): SQL query as generated by the LLM
+    """
+    def replace(match):
+        if match.group(1):
+            return match.group(1)
+        if match.group(2):
+            return match.group(2) + "\n"
+        return " "
+    return _SQL_TOKEN.sub(replace, query).strip().rstrip(";").strip()
+
+
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_TABLE_REF = re.compile(r"(?:\b(?:FROM|JOIN)\s+|,\s*)(\"[^\"]+\"|\[[^\]]+\]|`[^`]+`|\w+)(?:\s+(?:AS\s+)?(\w+))?", re.IGNORECASE)
+_KEYWORDS = {
+    "on", "where", "join", "left", "right", "inner", "outer", "cross", "natural", "group",
+    "order", "limit", "using", "union", "having", "set", "values", "select",
+}
+
+
+def mask_strings(query):
+    """Replaces string literals with '' so their contents are not parsed as SQL."""
+    return _STRING.sub("''", query)
+
+
+def table_aliases(query, tables):
+    """Maps the lowercased names and aliases a query uses to table names.
+
+    Tables are found after FROM, JOIN and commas, so a name in a select list
+    that happens to be a table name is mapped too, which is harmless here.
+
+    Args:
+        query (str): SQL query
+        tables (iterable): names of the tables in the database
+    """
+    by_name = {table.lower(): table for table in tables}
+    aliases = {}
+    for table, alias in _TABLE_REF.findall(mask_strings(query)):
+        match = by_name.get(unquote_identifier(table).lower())
+        if match is None:
+            continue
+        aliases[match.lower()] = match
+        if alias and alias.lower() not in _KEYWORDS:
+            aliases[alias.lower()] = match
+    return aliases
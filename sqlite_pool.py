@@ -0,0 +1,104 @@
+import time
+import sqlite3
+import threading
+from urllib.parse import quote
+
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+
+from utils import logger
+
+
+class PoolWaitStats:
+    """Time spent waiting for a connection to be checked out of the pool."""
+
+    def __init__(self, slow_wait=1.0):
+        self.slow_wait = slow_wait
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, seconds):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+        if seconds > self.slow_wait:
+            logger.warning(f"Waited {seconds:.2f}s for a SQLite connection, consider a larger pool")
+
+    def snapshot(self):
+        """Checkouts so far with their mean and maximum wait in milliseconds."""
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "mean_wait_ms": 1000 * self.total_wait / self.checkouts if self.checkouts else 0.0,
+                "max_wait_ms": 1000 * self.max_wait,
+            }
+
+
+class TimedQueuePool(QueuePool):
+    """QueuePool that records how long each checkout waited for a connection."""
+
+    def __init__(self, *args, wait_stats=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.wait_stats = wait_stats or PoolWaitStats()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            self.wait_stats.record(time.perf_counter() - start)
+
+    def recreate(self):
+        pool = super().recreate()
+        # keep the counters when the engine is disposed
+        pool.wait_stats = self.wait_stats
+        return pool
+
+
+def connect_readonly(db_filepath, mmap_size=256 * 1024 * 1024, cache_size=-64 * 1024, temp_store="MEMORY"):
+    """Opens a tuned, read-only connection to a SQLite database file.
+
+    The file is opened with `immutable=1`, so SQLite skips locking and change
+    detection entirely. The database must therefore be updated by replacing
+    the file, never in place; connections opened before the replacement keep
+    reading the old file until the pool is disposed.
+
+    Args:
+        db_filepath (str | Path): path to the SQLite database file
+        mmap_size (int): bytes of the file read through a memory map
+        cache_size (int): page cache size, negative values are in KiB
+        temp_store (str): where temp B-trees are built, "MEMORY" or "FILE"
+    """
+    uri = f"file:{quote(str(db_filepath))}?mode=ro&immutable=1"
+    conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+    conn.execute(f"PRAGMA mmap_size = {int(mmap_size)}")
+    conn.execute(f"PRAGMA cache_size = {int(cache_size)}")
+    conn.execute(f"PRAGMA temp_store = {temp_store}")
+    conn.execute("PRAGMA query_only = 1")
+    return conn
+
+
+def create_readonly_engine(db_filepath, pool_size=4, timeout=30, **pragmas):
+    """SQLAlchemy engine over a fixed-size pool of `connect_readonly` connections.
+
+    Checkouts are thread-safe and block for up to `timeout` seconds once all
+    `pool_size` connections are in use. Wait times are available from
+    `engine.pool.wait_stats`.
+
+    Args:
+        db_filepath (str | Path): path to the SQLite database file
+        pool_size (int): number of connections
+        timeout (float): seconds to wait for a free connection
+        **pragmas: passed on to `connect_readonly`
+    """
+    return create_engine(
+        "sqlite://",
+        creator=lambda: connect_readonly(db_filepath, **pragmas),
+        poolclass=TimedQueuePool,
+        pool_size=pool_size,
+        max_overflow=0,
+        pool_timeout=timeout,
+    )
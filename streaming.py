@@ -1,11 +1,86 @@
+import time
 from langchain_core.callbacks import BaseCallbackHandler
 
+SENTENCE_ENDINGS = (".", "!", "?", ":", "\n")
+
 class StreamHandler(BaseCallbackHandler):
+    """Renders streamed LLM tokens into a Streamlit container.
+
+    Tokens are collected in a list and the container is only re-rendered once
+    `flush_interval` seconds have passed or `flush_chars` characters are
+    pending, or when a token ends a sentence. Pass 0 for both to re-render on
+    every token. Whatever is still pending is flushed in `on_llm_end`.
+    """
     
-    def __init__(self, container, initial_text=""):
+    def __init__(self, container, initial_text="", flush_interval=0.1, flush_chars=200):
         self.container = container
+        self.flush_interval = flush_interval
+        self.flush_chars = flush_chars
         self.text = initial_text
+        self._last_flush = time.monotonic()
+
+    @property
+    def text(self):
+        if len(self._chunks) > 1:
+            self._chunks[:] = ["".join(self._chunks)]
+        return self._chunks[0] if self._chunks else ""
+
+    @text.setter
+    def text(self, value):
+        self._chunks = [value] if value else []
+        self._pending_chars = 0
+
+    def _should_flush(self, token):
+        if not (self.flush_interval or self.flush_chars):
+            return True
+        if self.flush_chars and self._pending_chars >= self.flush_chars:
+            return True
+        if self.flush_interval and time.monotonic() - self._last_flush >= self.flush_interval:
+            return True
+        return token.rstrip(" ").endswith(SENTENCE_ENDINGS)
+
+    def flush(self):
+        if self._pending_chars:
+            self.container.markdown(self.text)
+            self._pending_chars = 0
+            self._last_flush = time.monotonic()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self._chunks.append(token)
+        self._pending_chars += len(token)
+        if self._should_flush(token):
+            self.flush()
+
+    def on_llm_end(self, response, **kwargs):
+        self.flush()
+
+
+class FinalAnswerStreamHandler(StreamHandler):
+    """Streams only the agent's final answer into the container.
+
+    Every LLM call of an agent run starts from an empty buffer, and calls that
+    end in tool calls are wiped from the container, so only the text of the
+    last call (the answer shown to the user) stays on screen.
+    """
+
+    def _reset(self):
+        self.text = ""
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._reset()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._reset()
 
     def on_llm_new_token(self, token: str, **kwargs):
-        self.text += token
-        self.container.markdown(self.text)
\ No newline at end of file
+        if token:
+            super().on_llm_new_token(token, **kwargs)
+
+    def on_llm_end(self, response, **kwargs):
+        generations = response.generations[0] if response.generations else []
+        message = getattr(generations[0], "message", None) if generations else None
+        if getattr(message, "tool_calls", None):
+            self._reset()
+            self.container.empty()
+        else:
+            super().on_llm_end(response, **kwargs)
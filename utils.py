@@ -1,10 +1,16 @@
 import os
 import openai
+import functools
 import streamlit as st
-from datetime import datetime
 from streamlit.logger import get_logger
-from langchain_openai import ChatOpenAI, AzureChatOpenAI
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+import resource_cache
+from resource_cache import ResourceCache
+from model_catalog import ModelCatalog
+from llm_clients import LLMClientRegistry
 from langchain_community.chat_models import ChatOllama
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
 from langchain_community.embeddings.fastembed import FastEmbedEmbeddings
 
 logger = get_logger('Langchain-Chatbot')
@@ -17,7 +23,8 @@ def enable_chat_history(func):
         st.session_state["current_page"] = current_page
     if st.session_state["current_page"] != current_page:
         try:
-            st.cache_resource.clear()
+            clear_session_resources()
+            st.session_state.pop("history_shown", None)
             del st.session_state["current_page"]
             del st.session_state["messages"]
         except:
@@ -26,16 +33,49 @@ def enable_chat_history(func):
     # to show chat history on ui
     if "messages" not in st.session_state:
         st.session_state["messages"] = [{"role": "assistant", "content": "Please ask me anything about MyThanks!"}]
-    for msg in st.session_state["messages"]:
-        with st.chat_message(msg["role"]):
-            st.write(msg["content"])
-            if "fig" in msg:
-                st.plotly_chart(msg["fig"], use_container_width=True)
+
+    def render_chart(i, msg):
+        if "chart" in msg:
+            st.plotly_chart(msg["chart"].to_figure(), use_container_width=True)
+    render_chat_history(st.session_state["messages"], render_chart)
 
     def execute(*args, **kwargs):
         func(*args, **kwargs)
     return execute
 
+@functools.lru_cache(maxsize=1024)
+def message_markdown(content):
+    """Markdown for a chat message, memoized as history is redrawn on every rerun.
+
+    Dollar signs are escaped so that amounts are not rendered as LaTeX.
+    """
+    return str(content).replace("$", "\\$")
+
+def render_chat_history(messages, render_extras=None):
+    """Renders the most recent messages, with older ones behind "load earlier".
+
+    Only the last CHAT_HISTORY.PAGE_SIZE messages are rendered at first, and
+    each click on "load earlier" adds another page, so a rerun costs the same
+    however long the session gets.
+
+    Args:
+        messages (list): the session's chat messages
+        render_extras (callable): called with the index and message inside
+            each message's container, e.g. to draw its chart
+    """
+    page_size = st.secrets.get("CHAT_HISTORY", {}).get("PAGE_SIZE", 20)
+    shown = st.session_state.setdefault("history_shown", page_size)
+    start = max(0, len(messages) - shown)
+    if start and st.button(f"Load earlier messages ({start} more)", key="load_earlier_messages"):
+        st.session_state["history_shown"] = shown + page_size
+        st.rerun()
+    for i in range(start, len(messages)):
+        msg = messages[i]
+        with st.chat_message(msg["role"]):
+            st.markdown(message_markdown(msg["content"]))
+            if render_extras is not None:
+                render_extras(i, msg)
+
 def display_msg(msg, author):
     """Method to display message on the UI
 
@@ -48,6 +88,74 @@ def display_msg(msg, author):
     st.session_state.messages.append({"role": author, "content": msg})
     st.chat_message(author).write(msg)
 
+@st.cache_resource
+def get_resource_cache():
+    config = st.secrets.get("RESOURCE_CACHE", {})
+    return ResourceCache(
+        max_sessions=config.get("MAX_SESSIONS", 256),
+        max_session_entries=config.get("MAX_SESSION_ENTRIES", 32)
+    )
+
+def get_session_id():
+    ctx = get_script_run_ctx()
+    if ctx is None:
+        raise RuntimeError("Session resources can only be used from a Streamlit script thread")
+    return ctx.session_id
+
+def cache_resource(namespace, scope=resource_cache.GLOBAL, show_spinner=None, max_entries=None, ttl=None):
+    """Decorator caching a function's result in the shared resource cache.
+
+    Works like `st.cache_resource`: arguments whose name starts with "_" are
+    not part of the cache key. Unlike `st.cache_resource`, resources are
+    grouped in a namespace and can be scoped to the current session, so they
+    can be invalidated without affecting other sessions.
+
+    Args:
+        namespace (str): namespace the resource is counted and invalidated under
+        scope (str): resource_cache.GLOBAL or resource_cache.SESSION
+        show_spinner (str): spinner text shown while the resource is created
+        max_entries (int): maximum number of results kept for the namespace
+            (per session for session scope), least recently used first out
+        ttl (float): seconds a result is kept after it is created
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            def factory():
+                if show_spinner:
+                    with st.spinner(show_spinner):
+                        return func(*args, **kwargs)
+                return func(*args, **kwargs)
+            session_id = get_session_id() if scope == resource_cache.SESSION else None
+            key = resource_cache.call_key(func, args, kwargs)
+            return get_resource_cache().get(
+                namespace, key, factory, session_id=session_id, max_entries=max_entries, ttl=ttl
+            )
+        return wrapper
+    return decorator
+
+def clear_session_resources(namespace=None):
+    """Drops the current session's resources, leaving global ones cached."""
+    dropped = get_resource_cache().invalidate(namespace=namespace, session_id=get_session_id())
+    logger.info(f"Cleared {dropped} session resources, cache stats: {get_resource_cache().stats()}")
+
+@cache_resource("llm.registry")
+def get_llm_registry():
+    config = st.secrets.get("LLM_POOL", {})
+    return LLMClientRegistry(
+        max_connections=config.get("MAX_CONNECTIONS", 100),
+        max_keepalive_connections=config.get("MAX_KEEPALIVE_CONNECTIONS", 20),
+        keepalive_expiry=config.get("KEEPALIVE_EXPIRY", 60),
+        max_clients=config.get("MAX_CLIENTS", 32)
+    )
+
+@cache_resource("llm.model_catalog")
+def get_model_catalog():
+    return ModelCatalog(
+        ttl=st.secrets.get("MODEL_CATALOG", {}).get("TTL", 3600),
+        http_client=get_llm_registry().http_client
+    )
+
 def choose_custom_openai_key():
     openai_api_key = st.sidebar.text_input(
         label="OpenAI API Key",
@@ -62,10 +170,7 @@ def choose_custom_openai_key():
 
     model = "gpt-4o-mini"
     try:
-        client = openai.OpenAI(api_key=openai_api_key)
-        available_models = [{"id": i.id, "created":datetime.fromtimestamp(i.created)} for i in client.models.list() if str(i.id).startswith("gpt")]
-        available_models = sorted(available_models, key=lambda x: x["created"])
-        available_models = [i["id"] for i in available_models]
+        available_models = get_model_catalog().models(openai_api_key)
 
         model = st.sidebar.selectbox(
             label="Model",
@@ -107,43 +212,66 @@ def configure_llm():
         key="SELECTED_LLM"
         )
 
+    registry = get_llm_registry()
     if llm_opt == "gpt-4o-mini":
-        llm = ChatOpenAI(model_name=llm_opt, temperature=0, streaming=True, api_key=st.secrets.get("OPENAI_API_KEY"))
+        llm = registry.get("openai", model=llm_opt, api_key=st.secrets.get("OPENAI_API_KEY"), temperature=0, streaming=True)
     elif llm_opt == "Azure OpenAI":
         # Check secrets first, then fallback to sidebar
         if all(k in st.secrets for k in ["AZURE_OPENAI_API_KEY", "AZURE_OPENAI_ENDPOINT", "AZURE_OPENAI_DEPLOYMENT_NAME"]):
-            llm = AzureChatOpenAI(
-                azure_deployment=st.secrets["AZURE_OPENAI_DEPLOYMENT_NAME"],
-                openai_api_version=st.secrets.get("AZURE_OPENAI_API_VERSION", "2024-02-01"),
-                azure_endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
+            llm = registry.get(
+                "azure",
+                deployment=st.secrets["AZURE_OPENAI_DEPLOYMENT_NAME"],
+                endpoint=st.secrets["AZURE_OPENAI_ENDPOINT"],
                 api_key=st.secrets["AZURE_OPENAI_API_KEY"],
+                openai_api_version=st.secrets.get("AZURE_OPENAI_API_VERSION", "2024-02-01"),
                 temperature=0,
                 streaming=True
             )
         else:
             config = choose_azure_openai_config()
-            llm = AzureChatOpenAI(
-                azure_deployment=config["azure_deployment"],
-                openai_api_version=config["api_version"],
-                azure_endpoint=config["azure_endpoint"],
+            llm = registry.get(
+                "azure",
+                deployment=config["azure_deployment"],
+                endpoint=config["azure_endpoint"],
                 api_key=config["api_key"],
+                openai_api_version=config["api_version"],
                 temperature=0,
                 streaming=True
             )
     else:
         model, openai_api_key = choose_custom_openai_key()
-        llm = ChatOpenAI(model_name=model, temperature=0, streaming=True, api_key=openai_api_key)
+        llm = registry.get("openai", model=model, api_key=openai_api_key, temperature=0, streaming=True)
     return llm
 
 def print_qa(cls, question, answer):
     log_str = "\nUsecase: {}\nQuestion: {}\nAnswer: {}\n" + "------"*10
     logger.info(log_str.format(cls.__name__, question, answer))
 
-@st.cache_resource
+@cache_resource("embeddings.model")
 def configure_embedding_model():
-    embedding_model = FastEmbedEmbeddings(model_name="BAAI/bge-small-en-v1.5")
+    config = st.secrets.get("EMBEDDINGS", {})
+    embedding_model = FastEmbedEmbeddings(
+        model_name="BAAI/bge-small-en-v1.5",
+        threads=config.get("THREADS"),
+        batch_size=config.get("BATCH_SIZE", 256),
+        parallel=config.get("PARALLEL")
+    )
     return embedding_model
 
+@cache_resource("embeddings.cached_model")
+def configure_cached_embedding_model(cache_dir=".cache/embeddings"):
+    """Embedding model whose document embeddings are persisted on disk.
+
+    Vectors are keyed by a hash of the chunk text, namespaced by the model
+    name, so unchanged chunks are never embedded twice across sessions.
+    """
+    embedding_model = configure_embedding_model()
+    return CacheBackedEmbeddings.from_bytes_store(
+        embedding_model,
+        LocalFileStore(cache_dir),
+        namespace=embedding_model.model_name
+    )
+
 def sync_st_session():
     for k, v in st.session_state.items():
         st.session_state[k] = v
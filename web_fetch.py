@@ -0,0 +1,131 @@
+import os
+import json
+import hashlib
+import threading
+import traceback
+from pathlib import Path
+from urllib.parse import urlsplit
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Ubuntu; Linux x86_64; rv:88.0) Gecko/20100101 Firefox/88.0'
+}
+
+
+class PageFetcher:
+    """Fetches web pages concurrently over a pooled HTTP session.
+
+    Responses are cached on disk together with their ETag/Last-Modified
+    headers, so fetching a page again sends a conditional request and reuses
+    the cached body on a 304. The cache keeps at most `max_cache_entries`
+    pages, least recently used first out. Concurrent requests for pages of
+    the same site are limited to `per_host`; the limit is on the site being
+    fetched, not on `base_url`, since every request goes through a proxy.
+
+    Args:
+        base_url (str): prefix prepended to every url, e.g. a reader proxy
+        cache_dir (str): folder for the page cache
+        max_workers (int): maximum number of requests in flight
+        per_host (int): maximum number of requests in flight per site
+        timeout (tuple): connect and read timeouts in seconds
+        max_connections (int): connections kept open per server, i.e. to
+            the proxy when there is one, defaults to `max_workers`
+        max_cache_entries (int): maximum number of cached pages
+    """
+
+    def __init__(self, base_url="", cache_dir=".cache/pages", max_workers=8, per_host=4, timeout=(5, 30),
+                 max_connections=None, max_cache_entries=1000):
+        self.base_url = base_url
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.max_cache_entries = max_cache_entries
+        self._cache_entries = sum(1 for _ in self.cache_dir.glob("*.json"))
+        self.session = requests.Session()
+        self.session.headers.update(DEFAULT_HEADERS)
+        max_connections = max_connections or max_workers
+        adapter = HTTPAdapter(pool_connections=max_connections, pool_maxsize=max_connections)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._host_limits = defaultdict(lambda: threading.BoundedSemaphore(per_host))
+        self._lock = threading.Lock()
+
+    def _cache_path(self, url):
+        return self.cache_dir / f"{hashlib.sha256(url.encode()).hexdigest()}.json"
+
+    def _read_cache(self, url):
+        path = self._cache_path(url)
+        try:
+            entry = json.loads(path.read_text())
+            # the modification time doubles as the last use for eviction
+            os.utime(path)
+            return entry
+        except (OSError, ValueError):
+            return None
+
+    def _write_cache(self, url, response):
+        entry = {
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "content": response.text,
+        }
+        path = self._cache_path(url)
+        is_new = not path.exists()
+        path.write_text(json.dumps(entry))
+        if is_new:
+            with self._lock:
+                self._cache_entries += 1
+                if self._cache_entries > self.max_cache_entries:
+                    self._evict()
+        return entry
+
+    def _evict(self):
+        # drops the least recently used pages down to 90% of the limit, so
+        # the folder is not scanned on every write
+        paths = []
+        for path in self.cache_dir.glob("*.json"):
+            try:
+                paths.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+        paths.sort()
+        excess = len(paths) - int(self.max_cache_entries * 0.9)
+        for _, path in paths[:max(excess, 0)]:
+            path.unlink(missing_ok=True)
+        self._cache_entries = len(paths) - max(excess, 0)
+
+    def fetch(self, url):
+        """Returns the page content for `url`, or "" if it cannot be fetched."""
+        final_url = self.base_url + url
+        cached = self._read_cache(final_url)
+        headers = {}
+        if cached and cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached and cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
+
+        with self._lock:
+            host_limit = self._host_limits[urlsplit(url).netloc]
+        try:
+            with host_limit:
+                response = self.session.get(final_url, headers=headers, timeout=self.timeout)
+            if response.status_code == 304 and cached:
+                return cached["content"]
+            response.raise_for_status()
+            return self._write_cache(final_url, response)["content"]
+        except Exception:
+            traceback.print_exc()
+            # a stale page beats no page
+            return cached["content"] if cached else ""
+
+    def fetch_all(self, urls):
+        """Fetches all urls concurrently, returns their contents in order."""
+        if not urls:
+            return []
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(urls))) as pool:
+            return list(pool.map(self.fetch, urls))